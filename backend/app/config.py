@@ -6,6 +6,10 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME")
 SECRET_KEY = os.getenv("SECRET_KEY")
+REDIS_URL = os.getenv("REDIS_URL")  # Optional: enables the conversation context cache
+# Optional: days to keep chat messages; unset keeps them forever
+CONVERSATION_TTL_DAYS = int(os.getenv("CONVERSATION_TTL_DAYS")) if os.getenv("CONVERSATION_TTL_DAYS") else None
+CLEANUP_DUPLICATE_SLOTS = os.getenv("CLEANUP_DUPLICATE_SLOTS", "false").lower() == "true"
 
 if not SECRET_KEY:
     raise ValueError("SECRET_KEY is missing. Check your .env file.")
@@ -1,15 +1,24 @@
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-from app.config import MONGO_URI, DB_NAME
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.config import MONGO_URI, DB_NAME, CONVERSATION_TTL_DAYS
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Set up MongoDB client using Server API v1 (recommended for Atlas)
+# A single process-wide client with a warm, bounded connection pool
 try:
-    client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
+    client = MongoClient(
+        MONGO_URI,
+        server_api=ServerApi('1'),
+        maxPoolSize=50,
+        minPoolSize=5,
+        maxIdleTimeMS=60000,
+        socketTimeoutMS=5000,
+        serverSelectionTimeoutMS=3000,
+        retryWrites=True
+    )
     logger.info("MongoDB client initialized successfully")
 
     # Ping MongoDB to ensure connection is successful
@@ -20,6 +29,19 @@ try:
     db = client[DB_NAME]
     logger.info(f"Using database: {DB_NAME}")
 
+    # Async client for request paths that must not block the event loop
+    async_client = AsyncIOMotorClient(
+        MONGO_URI,
+        server_api=ServerApi('1'),
+        maxPoolSize=50,
+        minPoolSize=5,
+        maxIdleTimeMS=60000,
+        socketTimeoutMS=5000,
+        serverSelectionTimeoutMS=3000,
+        retryWrites=True
+    )
+    async_db = async_client[DB_NAME]
+
     # Verify collections exist
     collections = db.list_collection_names()
     logger.info(f"Available collections: {collections}")
@@ -29,6 +51,27 @@ try:
         db.create_collection('conversations')
         logger.info("Created conversations collection")
     
+    # Append-only chat log: time-series buckets per user. Requires MongoDB 6.0+ for the
+    # (email, seq) secondary index on a measurement field. Messages are kept forever
+    # unless CONVERSATION_TTL_DAYS opts in to expiry.
+    retention = {"expireAfterSeconds": CONVERSATION_TTL_DAYS * 24 * 60 * 60} if CONVERSATION_TTL_DAYS else {}
+    if 'conversation_messages' not in collections:
+        db.create_collection(
+            'conversation_messages',
+            timeseries={"timeField": "timestamp", "metaField": "email", "granularity": "seconds"},
+            **retention
+        )
+        logger.info("Created conversation_messages time-series collection")
+    else:
+        # Keep an existing collection's expiry in line with the setting, turning it off when unset
+        try:
+            db.command(
+                "collMod", "conversation_messages",
+                expireAfterSeconds=retention.get("expireAfterSeconds", "off")
+            )
+        except Exception as e:
+            logger.warning(f"Could not update conversation_messages retention: {str(e)}")
+    
     # Ensure scan_reports collection exists
     if 'scan_reports' not in collections:
         db.create_collection('scan_reports')
@@ -1,15 +1,32 @@
+import logging
+import os
+import time
+
+# Configure logging before any app module is imported, so LOG_LEVEL applies to all of them
+# (set LOG_LEVEL=WARNING in production to silence per-request traces)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import auth_routes, chat_routes, profile_routes, appointment_routes, scan_routes, speech_routes, doctor_availability_routes
-import logging
-import time
+from app.services.conversation_service import ConversationService
+from app.services.notification_service import close_notification_service
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="HealthMate API", version="1.0.0")
 
+# Create database indexes once per process instead of on every service construction
+@app.on_event("startup")
+async def create_indexes():
+    ConversationService.create_indexes()
+    ConversationService.migrate_embedded_messages()
+
+# QUIT pooled SMTP connections and cancel scheduled reminders on shutdown
+@app.on_event("shutdown")
+async def close_notifications():
+    await close_notification_service()
+
 # Add request logging middleware
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -1,6 +1,9 @@
 from typing import Dict, Optional, List
-from datetime import datetime, time, date
+from datetime import datetime, time, date, timedelta
 from pydantic import BaseModel, EmailStr
+from pymongo import InsertOne, DeleteMany
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
 from enum import Enum
 import logging
 
@@ -15,6 +18,9 @@ class DayOfWeek(str, Enum):
     SATURDAY = "saturday"
     SUNDAY = "sunday"
 
+# Day names indexed by date.weekday(), matching the WeeklySchedule field names
+DAY_NAMES = tuple(day.value for day in DayOfWeek)
+
 class BlockTimeReason(str, Enum):
     LUNCH = "lunch"
     SURGERY = "surgery"
@@ -62,6 +68,16 @@ class DailyOverride(BaseModel):
     updated_at: Optional[datetime] = None
 
 
+# Generated slots can always be rebuilt from the weekly schedule, so their bulk
+# writes skip the journal flush; bookings keep the default write concern
+GENERATED_SLOTS_WRITE_CONCERN = WriteConcern(w=1, j=False)
+
+# Fields returned for available slots; all present in the available-slots index
+AVAILABLE_SLOT_PROJECTION = {
+    "_id": 0, "doctor_email": 1, "slot_date": 1, "slot_time": 1, "is_available": 1, "appointment_id": 1
+}
+
+
 class DoctorAvailabilityModel:
     """Database operations for Doctor Availability - Pure data layer"""
     
@@ -127,10 +143,12 @@ class DoctorAvailabilityModel:
             
             slot_docs = []
             for slot in slots:
+                slot_time = slot["slot_time"] if isinstance(slot["slot_time"], time) else time.fromisoformat(str(slot["slot_time"]))
                 slot_doc = {
                     "doctor_email": doctor_email,
                     "slot_date": slot_date.isoformat(),
-                    "slot_time": slot["slot_time"].isoformat() if hasattr(slot["slot_time"], 'isoformat') else str(slot["slot_time"]),
+                    "slot_time": slot_time.isoformat(),
+                    "slot_start": datetime.combine(slot_date, slot_time),
                     "is_available": slot["is_available"],
                     "appointment_id": slot.get("appointment_id"),
                     "created_at": datetime.utcnow()
@@ -138,39 +156,62 @@ class DoctorAvailabilityModel:
                 slot_docs.append(slot_doc)
             
             if slot_docs:
-                # Use upsert to prevent duplicates
-                for slot_doc in slot_docs:
-                    db.appointment_slots.update_one(
-                        {
-                            "doctor_email": slot_doc["doctor_email"],
-                            "slot_date": slot_doc["slot_date"],
-                            "slot_time": slot_doc["slot_time"]
-                        },
-                        {"$set": slot_doc},
-                        upsert=True
-                    )
-                logger.info(f"Created/updated {len(slot_docs)} slots for {doctor_email} on {slot_date}")
+                inserted = DoctorAvailabilityModel.insert_appointment_slots(slot_docs)
+                logger.info(f"Created {inserted} slots for {doctor_email} on {slot_date}")
             
             return True
         except Exception as e:
             logger.error(f"Error creating appointment slots: {str(e)}")
             return False
     
+    @staticmethod
+    def insert_appointment_slots(slot_docs: List[Dict]) -> int:
+        """Insert slot documents in one unordered bulk write; returns the number inserted.
+
+        Slots that already exist are skipped by the unique
+        (doctor_email, slot_start) index rather than overwritten.
+        """
+        from ..database import db
+        
+        slots = db.appointment_slots.with_options(write_concern=GENERATED_SLOTS_WRITE_CONCERN)
+        try:
+            result = slots.bulk_write([InsertOne(doc) for doc in slot_docs], ordered=False)
+            return result.inserted_count
+        except BulkWriteError as e:
+            # Only duplicate-key errors are expected here
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            return e.details.get("nInserted", 0)
+    
+    @staticmethod
+    def replace_appointment_slots(delete_filter: Dict, slot_docs: List[Dict]) -> int:
+        """Delete the slots matching delete_filter and insert slot_docs in one ordered bulk write.
+
+        Returns the number of slots inserted.
+        """
+        from ..database import db
+        
+        slots = db.appointment_slots.with_options(write_concern=GENERATED_SLOTS_WRITE_CONCERN)
+        operations = [DeleteMany(delete_filter)] + [InsertOne(doc) for doc in slot_docs]
+        result = slots.bulk_write(operations, ordered=True)
+        return result.inserted_count
+    
     @staticmethod
     def get_available_slots(doctor_email: str, start_date: date, end_date: date) -> List[Dict]:
         """Get available appointment slots for a date range"""
         try:
             from ..database import db
             
-            # Convert date objects to strings for MongoDB query
-            start_date_str = start_date.isoformat()
-            end_date_str = end_date.isoformat()
-            
+            # Covered by the (doctor_email, is_available, slot_start, ...) index: the range
+            # scan is already in chronological order and only the projected fields are read
             slots = list(db.appointment_slots.find({
                 "doctor_email": doctor_email,
-                "slot_date": {"$gte": start_date_str, "$lte": end_date_str},
+                "slot_start": {
+                    "$gte": datetime.combine(start_date, time.min),
+                    "$lt": datetime.combine(end_date + timedelta(days=1), time.min)
+                },
                 "is_available": True
-            }, {"_id": 0}).sort("slot_date", 1).sort("slot_time", 1))
+            }, AVAILABLE_SLOT_PROJECTION).sort("slot_start", 1))
             
             return slots
         except Exception as e:
@@ -186,8 +227,7 @@ class DoctorAvailabilityModel:
             result = db.appointment_slots.update_one(
                 {
                     "doctor_email": doctor_email,
-                    "slot_date": slot_date.isoformat(),
-                    "slot_time": slot_time.isoformat(),
+                    "slot_start": datetime.combine(slot_date, slot_time),
                     "is_available": True
                 },
                 {
@@ -298,6 +338,19 @@ class DoctorAvailabilityModel:
             logger.error(f"Error fetching daily overrides range: {str(e)}")
             return []
     
+    @staticmethod
+    def get_daily_overrides_for_dates(doctor_email: str, dates: List[date]) -> List[Dict]:
+        """Get daily overrides for a set of dates"""
+        try:
+            from ..database import db
+            return list(db.daily_overrides.find({
+                "doctor_email": doctor_email,
+                "override_date": {"$in": [d.isoformat() for d in dates]}
+            }, {"_id": 0}))
+        except Exception as e:
+            logger.error(f"Error fetching daily overrides for dates: {str(e)}")
+            return []
+    
     @staticmethod
     def delete_daily_override(doctor_email: str, override_date: date) -> bool:
         """Delete daily override for a specific date"""
@@ -313,13 +366,14 @@ class DoctorAvailabilityModel:
             return False
     
     @staticmethod
-    def get_day_view(doctor_email: str, view_date: date) -> Dict:
+    def get_day_view(doctor_email: str, view_date: date, weekly_schedule: Optional[Dict] = None) -> Dict:
         """Get complete day view including weekly schedule and daily overrides"""
         try:
             from ..database import db
             
-            # Get weekly schedule
-            weekly_schedule = DoctorAvailabilityModel.get_weekly_schedule(doctor_email)
+            # Get weekly schedule unless the caller already has it
+            if weekly_schedule is None:
+                weekly_schedule = DoctorAvailabilityModel.get_weekly_schedule(doctor_email)
             
             # Get daily override if exists
             daily_override = DoctorAvailabilityModel.get_daily_override(doctor_email, view_date)
@@ -328,10 +382,10 @@ class DoctorAvailabilityModel:
             existing_slots = list(db.appointment_slots.find({
                 "doctor_email": doctor_email,
                 "slot_date": view_date.isoformat()
-            }, {"_id": 0}).sort("slot_time", 1))
+            }, {"_id": 0}).sort("slot_start", 1))
             
             # Get day name
-            day_name = view_date.strftime('%A').lower()
+            day_name = DAY_NAMES[view_date.weekday()]
             
             return {
                 "doctor_email": doctor_email,
@@ -16,23 +16,21 @@ async def chat(request: ChatRequest, current_user=Depends(get_current_user)):
     """Chat with AI assistant"""
     try:
         email = current_user.get("email", "unknown")
-        logger.info(f"Chat request received for email: {email}")
-        logger.info(f"Message: {request.message}")
-        logger.info(f"User data: {current_user}")
+        logger.info("Chat request received for email: %s", email)
+        logger.debug("Message: %s", request.message)
         
         # Input validation
         if not request.message.strip():
             raise HTTPException(status_code=400, detail="Message cannot be empty")
         
-        logger.info("Calling get_ai_response...")
         response = await get_ai_response(request.message, email)
-        logger.info(f"AI response generated: {response[:100]}...")
+        logger.debug("AI response generated: %.100s...", response)
         
         return {"response": response}
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error processing chat request: {str(e)}")
+        logger.error("Error processing chat request: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
@@ -2,8 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from typing import List
 from ..services.scan_service import ScanAnalysisService
-from ..services.segmentation_service import SegmentationService
-from ..services.breast_segmentation_service import BreastSegmentationService
+from ..services.segmentation_service import segmentation_service
+from ..services.breast_segmentation_service import breast_segmentation_service
 from ..models.scan_report import ScanReportCreate, ScanReportResponse, ScanReportUpdate, ScanReportModel
 from ..utils.jwt import get_current_user
 import logging
@@ -26,10 +26,8 @@ class TwoModalityRequest(BaseModel):
 class BreastSegmentRequest(BaseModel):
     image_data: str
 
-# Initialize services
+# Initialize services; segmentation services are the module-level singletons
 scan_service = ScanAnalysisService()
-segmentation_service = SegmentationService()
-breast_segmentation_service = BreastSegmentationService()
 
 @router.post("/analyze")
 async def analyze_medical_scan(
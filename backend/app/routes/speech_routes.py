@@ -1,16 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from ..services.speech_service import SpeechService
+from ..services.speech_service import get_speech_service
 from ..utils.jwt import get_current_user
 import logging
-import tempfile
-import os
 
 logger = logging.getLogger(__name__)
 router = APIRouter(tags=["Speech"])
 
-# Initialize service
-speech_service = SpeechService()
-
 @router.post("/transcribe")
 async def transcribe_audio(
     audio_file: UploadFile = File(...),
@@ -22,26 +17,15 @@ async def transcribe_audio(
         logger.info(f"Audio file: {audio_file.filename}, size: {audio_file.size}")
         logger.info(f"User data: {current_user}")
         
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-            content = await audio_file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
+        # Decode the upload from memory instead of a temporary file
+        content = await audio_file.read()
+        transcription = await get_speech_service().transcribe_bytes(content)
         
-        try:
-            # Transcribe audio
-            transcription = await speech_service.transcribe_audio(temp_file_path)
-            
-            return {
-                "transcription": transcription,
-                "filename": audio_file.filename,
-                "file_size": len(content)
-            }
-            
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
+        return {
+            "transcription": transcription,
+            "filename": audio_file.filename,
+            "file_size": len(content)
+        }
         
     except Exception as e:
         logger.error(f"Error transcribing audio: {str(e)}")
@@ -1,8 +1,13 @@
 import os
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import Optional
 import numpy as np
+from cachetools import TTLCache
 from dotenv import load_dotenv
+from ..utils.hashing import content_key
 
 logger = logging.getLogger(__name__)
 
@@ -13,10 +18,17 @@ class BreastSegmentationService:
     """
     Loads a Keras .h5 segmentation model for breast ultrasound analysis.
     The model path is taken from BREAST_SEGMENTATION_MODEL_PATH or a default location.
+    If a quantized TFLite export exists (BREAST_SEGMENTATION_TFLITE_PATH or the
+    default location) it is preferred for CPU inference.
     """
 
     def __init__(self, model_path: Optional[str] = None):
         self._model = None
+        self._predict_fn = None
+        self._interpreter = None
+        # Keras models are not safe under concurrent predict calls; a single
+        # worker serializes inference and keeps it off the event loop.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="breast-seg")
         # Resolve default path relative to this file, not CWD
         default_path = os.path.abspath(
             os.path.join(
@@ -29,10 +41,21 @@ class BreastSegmentationService:
         )
         env_path = os.getenv("BREAST_SEGMENTATION_MODEL_PATH")
         self._model_path = os.path.abspath(model_path or env_path or default_path)
+        default_tflite_path = os.path.join(os.path.dirname(default_path), "breast_segmentation_model_int8.tflite")
+        self._tflite_path = os.path.abspath(os.getenv("BREAST_SEGMENTATION_TFLITE_PATH") or default_tflite_path)
         logger.info(f"Breast segmentation model path set to: {self._model_path}")
+        # Successful segmentation results keyed by a hash of the uploaded image
+        self._result_cache: TTLCache = TTLCache(maxsize=256, ttl=86400)
 
     def _ensure_model_loaded(self):
-        if self._model is None:
+        if self._model is None and self._interpreter is None:
+            if os.path.exists(self._tflite_path):
+                try:
+                    self._load_tflite_model()
+                    return
+                except Exception as e:
+                    logger.warning(f"Quantized model loading failed, using Keras model: {e}")
+                    self._interpreter = None
             try:
                 # Import tensorflow/keras only when needed
                 from tensorflow import keras
@@ -86,10 +109,121 @@ class BreastSegmentationService:
                         except Exception as e3:
                             logger.error(f"All loading methods failed: {e3}")
                             raise e3
+                self._build_predict_fn()
             except Exception as exc:
                 logger.error(f"Failed to load breast segmentation model: {exc}")
                 raise
 
+    def _load_tflite_model(self):
+        """Load the quantized TFLite export of the breast segmentation model."""
+        import tensorflow as tf
+
+        logger.info(f"Loading quantized breast segmentation model from {self._tflite_path} ...")
+        interpreter = tf.lite.Interpreter(model_path=self._tflite_path)
+        interpreter.allocate_tensors()
+        self._interpreter = interpreter
+        self._tflite_input = interpreter.get_input_details()[0]
+        self._tflite_output = interpreter.get_output_details()[0]
+        logger.info("Quantized breast segmentation model loaded successfully")
+
+    def _model_input_shape(self) -> tuple:
+        """Input shape of the active model, with a None batch dimension."""
+        if self._interpreter is not None:
+            return (None,) + tuple(int(d) for d in self._tflite_input["shape"][1:])
+        return self._model.input_shape
+
+    def _run_tflite(self, batch: np.ndarray) -> np.ndarray:
+        """Run the TFLite interpreter one sample at a time, (de)quantizing int8 tensors."""
+        input_details = self._tflite_input
+        output_details = self._tflite_output
+        in_scale, in_zero_point = input_details["quantization"]
+        out_scale, out_zero_point = output_details["quantization"]
+
+        outputs = []
+        for sample in batch:
+            sample = sample[np.newaxis, ...]
+            if input_details["dtype"] != np.float32 and in_scale:
+                sample = np.round(sample / in_scale + in_zero_point)
+            self._interpreter.set_tensor(input_details["index"], sample.astype(input_details["dtype"]))
+            self._interpreter.invoke()
+            output = self._interpreter.get_tensor(output_details["index"])
+            if output_details["dtype"] != np.float32 and out_scale:
+                output = (output.astype(np.float32) - out_zero_point) * out_scale
+            outputs.append(output)
+        return np.concatenate(outputs, axis=0)
+
+    def export_quantized_model(self, output_path: Optional[str] = None, representative_images: Optional[np.ndarray] = None) -> str:
+        """
+        Convert the Keras model to a quantized TFLite file.
+
+        Without representative_images this applies dynamic-range quantization.
+        With a stack of preprocessed (128, 128) images in [0,1] it produces a
+        full-integer int8 model calibrated on those samples.
+        """
+        import tensorflow as tf
+
+        self._ensure_model_loaded()
+        if self._model is None:
+            raise ValueError("Quantized export requires the Keras model; a TFLite model is already active")
+
+        converter = tf.lite.TFLiteConverter.from_keras_model(self._model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+        if representative_images is not None:
+            input_rank = len(self._model.input_shape)
+
+            def representative_dataset():
+                for image in representative_images:
+                    sample = np.asarray(image, dtype=np.float32)[np.newaxis, ...]
+                    if input_rank == 4 and sample.ndim == 3:
+                        sample = sample[..., np.newaxis]
+                    yield [sample]
+
+            converter.representative_dataset = representative_dataset
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+
+        tflite_model = converter.convert()
+        output_path = os.path.abspath(output_path or self._tflite_path)
+        with open(output_path, "wb") as f:
+            f.write(tflite_model)
+        logger.info(f"Quantized breast segmentation model written to {output_path}")
+        return output_path
+
+    def _build_predict_fn(self):
+        """
+        Trace the model into an XLA-compiled concrete function so conv/BN/ReLU
+        blocks are fused into fewer kernels. Falls back to model.predict if
+        tracing is not possible for this model.
+        """
+        try:
+            import tensorflow as tf
+
+            input_spec = tf.TensorSpec((None,) + tuple(self._model.input_shape[1:]), tf.float32)
+            model = self._model
+            self._predict_fn = tf.function(
+                lambda x: model(x, training=False),
+                jit_compile=True,
+                input_signature=[input_spec]
+            ).get_concrete_function()
+            logger.info("Breast segmentation model compiled with XLA")
+        except Exception as e:
+            logger.warning(f"XLA compilation unavailable, using model.predict: {e}")
+            self._predict_fn = None
+
+    def _run_model(self, batch: np.ndarray) -> np.ndarray:
+        """Run inference through the compiled function, falling back to model.predict."""
+        if self._interpreter is not None:
+            return self._run_tflite(batch.astype(np.float32, copy=False))
+        if self._predict_fn is not None:
+            try:
+                return self._predict_fn(batch.astype(np.float32, copy=False)).numpy()
+            except Exception as e:
+                logger.warning(f"XLA inference failed, falling back to model.predict: {e}")
+                self._predict_fn = None
+        return self._model.predict(batch)
+
     def predict_mask(self, image_array: np.ndarray) -> np.ndarray:
         """
         Runs model inference and returns a binary mask for breast ultrasound.
@@ -106,13 +240,16 @@ class BreastSegmentationService:
         if image_array.ndim == 3:
             image_array = np.expand_dims(image_array, axis=0)
 
-        preds = self._model.predict(image_array)
+        preds = self._run_model(image_array)
         return preds
 
-    def predict_from_ultrasound(self, ultrasound_image: np.ndarray) -> np.ndarray:
+    def predict_from_ultrasound(self, ultrasound_image: np.ndarray, preprocessed: bool = False) -> np.ndarray:
         """
         Accepts a 2D array (grayscale) for breast ultrasound, resizes and normalizes
         to [0,1], and returns binary segmentation mask.
+
+        Pass preprocessed=True when the caller already supplies a (128, 128)
+        float32 array in [0,1]; resizing and normalization are then skipped.
         """
         from PIL import Image
 
@@ -122,10 +259,12 @@ class BreastSegmentationService:
         self._ensure_model_loaded()
 
         # Handle different input types
-        if isinstance(ultrasound_image, np.ndarray):
+        if preprocessed:
+            ultrasound_np = ultrasound_image
+        elif isinstance(ultrasound_image, np.ndarray):
             # If already a numpy array, use it directly
             if ultrasound_image.ndim == 2:  # (height, width)
-                ultrasound_np = ultrasound_image.astype(np.float32)
+                ultrasound_np = ultrasound_image.astype(np.float32, copy=False)
             elif ultrasound_image.ndim == 3:  # (height, width, channels)
                 # Convert to grayscale if needed
                 if ultrasound_image.shape[2] == 3:
@@ -140,19 +279,19 @@ class BreastSegmentationService:
             if ultrasound_np.max() > 1.0:
                 ultrasound_np = ultrasound_np / 255.0
                 
-            # Resize if needed
+            # Resize if needed; the array is already single-channel float32, so
+            # resize it as a float ("F" mode) image without a uint8 round-trip
             if ultrasound_np.shape != (128, 128):
-                ultrasound_pil = Image.fromarray((ultrasound_np * 255).astype(np.uint8)).convert("L")
-                ultrasound_resized = ultrasound_pil.resize((128, 128))
-                ultrasound_np = np.array(ultrasound_resized, dtype=np.float32) / 255.0
+                ultrasound_resized = Image.fromarray(ultrasound_np).resize((128, 128), Image.BILINEAR)
+                ultrasound_np = np.clip(np.asarray(ultrasound_resized, dtype=np.float32), 0.0, 1.0)
         else:
             # Handle PIL Image
             ultrasound_pil = ultrasound_image.convert("L")
-            ultrasound_resized = ultrasound_pil.resize((128, 128))
+            ultrasound_resized = ultrasound_pil.resize((128, 128), Image.BILINEAR)
             ultrasound_np = np.array(ultrasound_resized, dtype=np.float32) / 255.0
 
         # Check model input shape to determine correct dimensions
-        model_input_shape = self._model.input_shape
+        model_input_shape = self._model_input_shape()
         logger.info(f"Model input shape: {model_input_shape}")
         logger.info(f"Processed image shape: {ultrasound_np.shape}")
         
@@ -170,16 +309,30 @@ class BreastSegmentationService:
             ultrasound_batched = np.expand_dims(ultrasound_batched, axis=-1)  # (1, 128, 128, 1)
 
         logger.info(f"Final input shape for prediction: {ultrasound_batched.shape}")
-        preds = self._model.predict(ultrasound_batched)
+        preds = self._run_model(ultrasound_batched)
         logger.info(f"Model prediction shape: {preds.shape}")
         logger.info(f"Model prediction dtype: {preds.dtype}")
         return preds
 
+    async def predict_async(self, ultrasound_image: np.ndarray, preprocessed: bool = False) -> np.ndarray:
+        """Run predict_from_ultrasound on the inference worker without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            partial(self.predict_from_ultrasound, ultrasound_image, preprocessed)
+        )
+
     async def segment_breast_ultrasound(self, image_data: str) -> dict:
         """
         High-level method for breast ultrasound segmentation.
         This method handles the complete workflow from base64 image to segmentation result.
         """
+        key = content_key(image_data)
+        cached = self._result_cache.get(key)
+        if cached is not None:
+            logger.info("Breast ultrasound segmentation served from cache")
+            return dict(cached)
+
         try:
             import base64
             from PIL import Image
@@ -189,17 +342,15 @@ class BreastSegmentationService:
             image_bytes = base64.b64decode(image_data)
             image = Image.open(io.BytesIO(image_bytes))
             
-            # Convert to numpy array
+            # Convert to grayscale and resize once on the decoded 8-bit image
             if image.mode != 'L':
                 image = image.convert('L')
-            image_array = np.array(image, dtype=np.float32)
-            
-            # Normalize if needed
-            if image_array.max() > 1.0:
-                image_array = image_array / 255.0
+            if image.size != (128, 128):
+                image = image.resize((128, 128), Image.BILINEAR)
+            image_array = np.asarray(image, dtype=np.float32) / 255.0
             
             # Get segmentation prediction
-            prediction = self.predict_from_ultrasound(image_array)
+            prediction = await self.predict_async(image_array, preprocessed=True)
             
             # Process prediction to get binary mask
             logger.info(f"Prediction shape: {prediction.shape}")
@@ -287,7 +438,7 @@ class BreastSegmentationService:
             else:
                 recommendations.append("Continue regular breast screening schedule")
             
-            return {
+            result = {
                 "success": True,
                 "segmentation_mask": mask_base64,
                 "statistics": {
@@ -305,6 +456,9 @@ class BreastSegmentationService:
                 "recommendations": recommendations,
                 "message": "Breast ultrasound segmentation completed successfully"
             }
+            self._result_cache[key] = result
+            # Callers add keys such as report_id, so hand out a copy
+            return dict(result)
             
         except Exception as e:
             logger.error(f"Error in breast ultrasound segmentation: {str(e)}")
@@ -1,65 +1,87 @@
-from openai import OpenAI
 import os
 from dotenv import load_dotenv
+from .openai_client import get_openai_client
 from .prompt_service import MedicalPromptEngine
 from .conversation_service import ConversationService
 from ..models.chat import ConversationHistory, Message
 from datetime import datetime
+from functools import cache
 import logging
+import re
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
-logger.info(f"OpenAI API key available: {bool(api_key)}")
+logger.info("OpenAI API key available: %s", bool(api_key))
 if not api_key:
     logger.error("OPENAI_API_KEY not found in environment variables")
     raise ValueError("OPENAI_API_KEY is required but not found")
 
-client = OpenAI(api_key=api_key)
-prompt_engine = MedicalPromptEngine()
-conversation_service = ConversationService()
+# Async client so chat completions don't block the event loop; shared with the
+# health classifier, so both keep connections to the API alive in one pool
+client = get_openai_client()
+
+NON_HEALTH_RESPONSE = "I'm a medical assistant focused on health concerns. Please let me know if you have any medical questions or symptoms you'd like to discuss."
+
+# Greetings and acknowledgements that never need the health classifier
+_TRIVIAL_MESSAGE = re.compile(
+    r"^\s*(hi|hey|hello|hiya|yo|thanks|thank you|thx|ty|ok|okay|bye|goodbye|good (morning|afternoon|evening|night))\W*$",
+    re.IGNORECASE
+)
+
+@cache
+def get_prompt_engine() -> MedicalPromptEngine:
+    """Shared MedicalPromptEngine, built on first use."""
+    return MedicalPromptEngine()
+
+@cache
+def get_conversation_service() -> ConversationService:
+    """Shared ConversationService, built on first use."""
+    return ConversationService()
 
 async def get_ai_response(message: str, email: str) -> str:
     """Get AI response with optimized conversation management and no redundancy."""
-    logger.info(f"Getting AI response for email: {email}")
-    logger.info(f"Message received: {message}")
+    prompt_engine = get_prompt_engine()
+    conversation_service = get_conversation_service()
+
+    # Short-circuit greetings before loading context or calling OpenAI
+    if _TRIVIAL_MESSAGE.match(message):
+        logger.info("Trivial message short-circuited for email: %s", email)
+        await conversation_service.add_conversation_turn(email, message, NON_HEALTH_RESPONSE)
+        return NON_HEALTH_RESPONSE
+    logger.info("Getting AI response for email: %s", email)
+    logger.debug("Message received: %s", message)
     
     # Get conversation context once (optimized)
-    conversation_history = conversation_service.get_context(email)
-    logger.info(f"Conversation history: {conversation_history}")
+    conversation_history = await conversation_service.get_context(email)
+    logger.debug("Conversation history: %d messages", len(conversation_history))
     
-    # Check if health-related using AI with conversation context
-    is_health = prompt_engine.is_health_related(message, conversation_history)
-    logger.info(f"Message health-related check: {is_health} for message: {message}")
+    # Check if health-related using AI; the classifier judges the message on its own
+    is_health = await prompt_engine.is_health_related_async(message)
+    logger.info("Message health-related check: %s", is_health)
     
     if not is_health:
-        logger.info(f"Message not health-related: {message}")
-        non_health_response = "I'm a medical assistant focused on health concerns. Please let me know if you have any medical questions or symptoms you'd like to discuss."
         # Store conversation turn atomically (no redundancy)
-        conversation_service.add_conversation_turn(email, message, non_health_response)
-        return non_health_response
+        await conversation_service.add_conversation_turn(email, message, NON_HEALTH_RESPONSE)
+        return NON_HEALTH_RESPONSE
 
     # Create context-aware prompt
-    prompt = prompt_engine.create_context_aware_prompt(message, conversation_history)
-    logger.info(f"Generated prompt: {prompt[:100]}...")
+    prompt = await prompt_engine.create_context_aware_prompt(message, conversation_history)
+    logger.debug("Generated prompt: %.100s...", prompt)
     
     # Create message list with context
     messages = [
-        {"role": "system", "content": prompt_engine.system_context},
+        prompt_engine.system_message,
         *conversation_history,
         {"role": "user", "content": message}
     ]
     
-    logger.info(f"Final messages for OpenAI: {messages}")
-    
     try:
-        logger.info(f"Calling OpenAI API with {len(messages)} messages")
+        logger.info("Calling OpenAI API with %d messages", len(messages))
         
         # Get response from OpenAI using GPT-4.1
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="gpt-4-1106-preview",
             messages=messages,
             temperature=0.3,
@@ -71,56 +93,49 @@ async def get_ai_response(message: str, email: str) -> str:
             seed=42
         )
         
-        logger.info(f"OpenAI API response received: {response}")
-        
         # Extract and process response
         if not response.choices or len(response.choices) == 0:
             logger.error("No choices in OpenAI response")
             raise Exception("No response choices from OpenAI")
         
         ai_response = response.choices[0].message.content
-        logger.info(f"Extracted AI response: {ai_response}")
         
         if not ai_response:
             logger.error("Empty AI response")
             raise Exception("Empty response from OpenAI")
         
         # Store conversation turn atomically (no redundancy)
-        conversation_service.add_conversation_turn(email, message, ai_response)
+        await conversation_service.add_conversation_turn(email, message, ai_response)
         
         # Add disclaimer if needed
         final_response = prompt_engine.add_medical_disclaimer(ai_response)
-        logger.info(f"Final response: {final_response}")
         return final_response
         
     except Exception as e:
-        logger.error(f"Error getting AI response: {str(e)}")
+        logger.error("Error getting AI response: %s", e)
         # Fallback to GPT-3.5 if GPT-4.1 fails
         try:
             logger.info("Trying GPT-3.5 fallback...")
-            response = client.chat.completions.create(
+            response = await client.chat.completions.create(
                 model="gpt-3.5-turbo",
                 messages=messages,
                 temperature=0.3,
                 max_tokens=100
             )
-            logger.info(f"GPT-3.5 response: {response}")
-            
             if not response.choices or len(response.choices) == 0:
                 logger.error("No choices in GPT-3.5 response")
                 raise Exception("No response choices from GPT-3.5")
             
             ai_response = response.choices[0].message.content
-            logger.info(f"GPT-3.5 AI response: {ai_response}")
             
             if not ai_response:
                 logger.error("Empty GPT-3.5 response")
                 raise Exception("Empty response from GPT-3.5")
             
             # Store conversation turn atomically (no redundancy)
-            conversation_service.add_conversation_turn(email, message, ai_response)
+            await conversation_service.add_conversation_turn(email, message, ai_response)
             return prompt_engine.add_medical_disclaimer(ai_response)
         except Exception as fallback_error:
-            logger.error(f"Fallback error: {str(fallback_error)}")
+            logger.error("Fallback error: %s", fallback_error)
             # Return a simple response if all AI calls fail
             return "I understand you said: " + message + ". How can I help you with your health concerns?"
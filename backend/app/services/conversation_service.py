@@ -1,85 +1,388 @@
-from typing import List, Dict, Optional
-from datetime import datetime
+from typing import List, Dict, Optional, AsyncIterator, Sequence, Mapping, Tuple
+from datetime import datetime, timedelta
+from copy import copy
+from functools import wraps
+import inspect
+import orjson
+from cachetools import TTLCache
+from pymongo import ReturnDocument
+from pymongo.write_concern import WriteConcern
 from ..models.chat import ConversationHistory, Message, Conversation
-from ..database import db
+from ..database import db, async_db
+from ..config import REDIS_URL, CONVERSATION_TTL_DAYS
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Static projections, shared across calls instead of rebuilt per query
+_CONTEXT_PROJECTION = {"_id": 0, "role": 1, "content": 1}
+_MESSAGE_PROJECTION = {"_id": 0, "role": 1, "content": 1, "timestamp": 1}
+_SEQ_PROJECTION = {"_id": 0, "last_seq": 1}
+_ALLOCATE_PROJECTION = {"_id": 0, "last_seq": 1, "recent": 1}
+# A migration claim older than this is treated as abandoned by a crashed worker
+_MIGRATION_CLAIM_TIMEOUT = timedelta(hours=1)
+# Lifetime of a Redis context window after its last write: a day, and never longer
+# than conversation_messages keeps the messages it mirrors, when retention is set
+_CONTEXT_CACHE_TTL_SECONDS = min(CONVERSATION_TTL_DAYS or 1, 1) * 24 * 60 * 60
+
+def _create_redis_client():
+    """Create the Redis client used for the context cache, or None if unavailable."""
+    if not REDIS_URL:
+        return None
+    try:
+        import redis.asyncio as redis
+        return redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    except ImportError:
+        logger.warning("redis package not installed, conversation context cache disabled")
+        return None
+
+def _mongo_op(name: str, default=None):
+    """Log and swallow errors from a MongoDB operation, returning a copy of `default`.
+
+    Works for both plain and async methods.
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception as e:
+                    logger.error(f"Error in {name}: {str(e)}")
+                    return copy(default)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"Error in {name}: {str(e)}")
+                return copy(default)
+        return wrapper
+    return decorator
+
 class ConversationService:
-    """Service layer for conversation management - handles all business logic"""
+    """
+    Service layer for conversation management - handles all business logic
+
+    Storage layout: one `conversations` document per user holding metadata and the
+    last allocated message sequence number (last_seq), and one
+    `conversation_messages` document per message keyed by (email, seq). Appending a
+    message is an insert rather than a rewrite of a growing per-user document.
+    conversation_messages is a time-series collection (timeField timestamp, metaField
+    email), so messages are bucketed per user; they expire only when CONVERSATION_TTL_DAYS
+    is set. Needs MongoDB 6.0+ for the (email, seq) index. Time-series collections can't
+    hold a unique index, so every seq must come from the atomic $inc in _allocate_seq.
+    """
     
     def __init__(self):
         self.context_window = 10
-        # Create index for better query performance
+        # Invariant part of the conversation upsert document
+        self._insert_defaults = {"context_window": self.context_window}
+        # Chat messages don't need a journal flush per write
+        write_concern = WriteConcern(w=1, j=False)
+        self._conversation_writes = async_db.conversations.with_options(write_concern=write_concern)
+        self._message_writes = async_db.conversation_messages.with_options(write_concern=write_concern)
+        self.redis = _create_redis_client()
+        # Short-lived per-process copy of get_context results, invalidated on writes
+        self._local_context: TTLCache = TTLCache(maxsize=1024, ttl=2)
+    
+    @staticmethod
+    def create_indexes():
+        """
+        Create the conversations indexes; run once at application startup.
+        Each step handles its own errors, so one failing index (e.g. duplicate
+        emails blocking the unique one) doesn't keep the others from being built.
+        """
+        # One conversation document per user
+        unique_email = ConversationService._create_index(
+            db.conversations, [("email", 1)], unique=True, name="email_unique"
+        )
+        # Newest-first per user for context reads; time-series collections
+        # don't support unique indexes, seq uniqueness comes from _allocate_seq
+        ConversationService._create_index(db.conversation_messages, [("email", 1), ("seq", -1)])
+        # Superseded by the unique email index, dropped only once it exists; the
+        # stats index is no longer queried
+        obsolete = ("email_1", "email_unique_partial", "email_stats_covering") if unique_email else ("email_stats_covering",)
+        ConversationService._drop_indexes(db.conversations, obsolete)
+
+    @staticmethod
+    @_mongo_op("create_index", default=False)
+    def _create_index(collection, keys, **kwargs) -> bool:
+        """Create one index; False (logged) if it can't be built."""
+        name = collection.create_index(keys, **kwargs)
+        logger.info(f"Created index {name} on {collection.name}")
+        return True
+
+    @staticmethod
+    @_mongo_op("drop_indexes")
+    def _drop_indexes(collection, names):
+        """Drop the named indexes that exist on the collection."""
+        existing = collection.index_information()
+        for name in names:
+            if name in existing:
+                collection.drop_index(name)
+
+    @staticmethod
+    def migrate_embedded_messages():
+        """
+        Move messages still embedded in conversations documents into conversation_messages.
+        Safe to run from every worker at once: each conversation is claimed atomically
+        before it is moved, and a failing conversation doesn't stop the others.
+        """
+        while True:
+            now = datetime.utcnow()
+            try:
+                # Unclaimed, or claimed by a run that died more than _MIGRATION_CLAIM_TIMEOUT ago
+                convo = db.conversations.find_one_and_update(
+                    {
+                        "messages": {"$exists": True},
+                        "$or": [
+                            {"migrating_since": {"$exists": False}},
+                            {"migrating_since": {"$lt": now - _MIGRATION_CLAIM_TIMEOUT}}
+                        ]
+                    },
+                    {"$set": {"migrating_since": now}},
+                    projection={"email": 1, "messages": 1, "migration_first_seq": 1}
+                )
+            except Exception as e:
+                logger.error(f"Error in migrate_embedded_messages: {str(e)}")
+                return
+            if convo is None:
+                return
+            # On failure the claim stays, so this run moves on instead of retrying it
+            ConversationService._migrate_conversation(convo)
+
+    @staticmethod
+    @_mongo_op("migrate_conversation", default=False)
+    def _migrate_conversation(convo: Dict) -> bool:
+        """Move one claimed conversation's embedded messages, numbering them via last_seq."""
+        email = convo["email"]
+        messages = convo.get("messages") or []
+        first_seq = convo.get("migration_first_seq")
+        if messages and first_seq is None:
+            # Reserve the seqs through the same $inc as _allocate_seq, and record them so
+            # a rerun after an interrupted insert reuses them instead of numbering twice
+            allocated = db.conversations.find_one_and_update(
+                {"_id": convo["_id"]},
+                {"$inc": {"last_seq": len(messages)}},
+                projection=_SEQ_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+            first_seq = allocated["last_seq"] - len(messages) + 1
+            db.conversations.update_one({"_id": convo["_id"]}, {"$set": {"migration_first_seq": first_seq}})
+        
+        if messages:
+            now = datetime.utcnow()
+            # Only this claimed migration writes seqs in the reserved range
+            existing = {
+                doc["seq"] for doc in db.conversation_messages.find(
+                    {"email": email, "seq": {"$gte": first_seq, "$lt": first_seq + len(messages)}},
+                    {"_id": 0, "seq": 1}
+                )
+            }
+            docs = [
+                {
+                    "email": email,
+                    "seq": seq,
+                    "role": msg.get("role"),
+                    "content": msg.get("content"),
+                    # Time-series documents must carry the time field
+                    "timestamp": msg.get("timestamp") or now
+                }
+                for seq, msg in enumerate(messages, start=first_seq)
+                if seq not in existing
+            ]
+            if docs:
+                db.conversation_messages.insert_many(docs, ordered=False)
+        
+        db.conversations.update_one(
+            {"_id": convo["_id"]},
+            {"$unset": {"messages": "", "migrating_since": "", "migration_first_seq": ""}}
+        )
+        logger.info("Migrated %d embedded messages for email: %s", len(messages), email)
+        return True
+
+    def _context_key(self, email: str) -> str:
+        return f"chat:{email}"
+
+    async def _get_cached_context(self, email: str) -> Optional[List[Dict[str, str]]]:
+        """Read the sliding context window from Redis; None on a miss."""
+        if self.redis is None:
+            return None
         try:
-            db.conversations.create_index([("email", 1)])
-            logger.info("Successfully created index on email field in conversations collection")
+            raw = await self.redis.lrange(self._context_key(email), -self.context_window, -1)
+            # Decode the whole window in one orjson call instead of one call per message
+            return orjson.loads("[" + ",".join(raw) + "]") if raw else None
         except Exception as e:
-            logger.error(f"Error creating index: {str(e)}")
+            logger.warning("Redis context read failed: %s", e)
+            return None
+
+    async def _cache_context(self, email: str, messages: Sequence[Mapping[str, str]], replace: bool = False):
+        """Write messages to the Redis sliding window and trim it to context_window.
 
-    def get_context(self, email: str) -> List[Dict[str, str]]:
-        """Get recent conversation context from the user's messages array."""
+        With replace=False messages are only appended to an already cached window,
+        so an evicted key is rebuilt from MongoDB instead of holding a partial history.
+        """
+        if self.redis is None or not messages:
+            return
         try:
-            logger.info(f"Getting context for email: {email}")
-            convo = db.conversations.find_one(
-                {"email": email}, 
-                {"_id": 0, "messages": 1}
-            )
-            
-            if not convo or "messages" not in convo:
-                logger.info(f"No conversation found for email: {email}")
-                return []
-                
-            # Get the last N messages
-            messages = convo["messages"][-self.context_window:]
-            logger.info(f"Retrieved {len(messages)} messages for email: {email}")
-            return [{"role": msg["role"], "content": msg["content"]} for msg in messages]
-            
+            key = self._context_key(email)
+            values = [orjson.dumps(msg) for msg in messages]
+            pipe = self.redis.pipeline()
+            if replace:
+                pipe.delete(key)
+                pipe.rpush(key, *values)
+            else:
+                pipe.rpushx(key, *values)
+            pipe.ltrim(key, -self.context_window, -1)
+            pipe.expire(key, _CONTEXT_CACHE_TTL_SECONDS)
+            await pipe.execute()
         except Exception as e:
-            logger.error(f"Error getting context from MongoDB: {str(e)}")
-            return []
+            logger.warning("Redis context write failed: %s", e)
 
+    async def get_context(self, email: str) -> Sequence[Mapping[str, str]]:
+        """
+        Get recent conversation context, served from process memory or Redis when cached.
+        The result is a shared, read-only tuple; callers must not modify its messages.
+        """
+        context = self._local_context.get(email)
+        if context is not None:
+            return context
 
-    def add_conversation_turn(self, email: str, user_message: str, assistant_message: str) -> bool:
-        """Add a complete conversation turn (user + assistant) atomically."""
-        try:
-            user_msg = {
-                "role": "user",
-                "content": user_message,
-                "timestamp": datetime.utcnow()
-            }
-            
-            assistant_msg = {
-                "role": "assistant", 
-                "content": assistant_message,
-                "timestamp": datetime.utcnow()
-            }
-            
-            logger.info(f"Adding conversation turn for email: {email}")
+        cached = await self._get_cached_context(email)
+        if cached is not None:
+            context = tuple(cached)
+            self._local_context[email] = context
+            return context
+
+        return await self._load_context(email)
+
+    @_mongo_op("get_context", default=())
+    async def _load_context(self, email: str) -> Sequence[Mapping[str, str]]:
+        """Read the context window from MongoDB and populate both caches."""
+        logger.debug("Getting context for email: %s", email)
+        # Last N messages newest-first from the (email, seq) index; only role/content
+        latest = await async_db.conversation_messages.find(
+            {"email": email},
+            _CONTEXT_PROJECTION
+        ).sort("seq", -1).limit(self.context_window).to_list(length=self.context_window)
+        
+        if not latest:
+            logger.debug("No conversation found for email: %s", email)
+            self._local_context[email] = ()
+            return ()
             
-            # Atomic operation to add both messages
-            result = db.conversations.update_one(
-                {"email": email},
+        context = tuple(reversed(latest))
+        logger.debug("Retrieved %d messages for email: %s", len(context), email)
+        await self._cache_context(email, context, replace=True)
+        self._local_context[email] = context
+        return context
+
+
+    async def add_conversation_turn(self, email: str, user_message: str, assistant_message: str) -> bool:
+        """Add a complete conversation turn (user + assistant) atomically."""
+        now = datetime.utcnow()
+        user_msg = {
+            "role": "user",
+            "content": user_message,
+            "timestamp": now
+        }
+        
+        assistant_msg = {
+            "role": "assistant", 
+            "content": assistant_message,
+            "timestamp": now
+        }
+        
+        logger.debug("Adding conversation turn for email: %s", email)
+        return await self.add_messages_bulk(email, [user_msg, assistant_msg], now)
+
+    async def add_turn_and_get_context(self, email: str, user_message: str, assistant_message: str) -> Sequence[Mapping[str, str]]:
+        """
+        Add a conversation turn and return the updated context window.
+        The write's seq allocation returns the conversation's recent window, so
+        no read round trip is made, with or without Redis; only a conversation
+        whose window predates the `recent` field falls back to get_context.
+        """
+        if not await self.add_conversation_turn(email, user_message, assistant_message):
+            return ()
+        return await self.get_context(email)
+
+    async def add_messages_bulk(self, email: str, messages: List[Dict], now: Optional[datetime] = None) -> bool:
+        """Append several messages to a user's conversation with a single insert."""
+        return await self._write_messages({email: messages}, now)
+
+    async def _allocate_seq(self, email: str, messages: List[Dict], now: datetime) -> Tuple[int, Optional[tuple]]:
+        """
+        Reserve sequence numbers for a user's new messages and append them to the
+        conversation's `recent` window in the same update. Returns the first seq and
+        the updated window, or None for the window if it doesn't yet hold every one
+        of the last context_window messages (e.g. written before `recent` existed).
+        """
+        entries = [{"role": msg["role"], "content": msg["content"]} for msg in messages]
+        convo = await self._conversation_writes.find_one_and_update(
+            {"email": email},
+            {
+                "$inc": {"last_seq": len(messages)},
+                "$set": {"updated_at": now},
+                "$push": {"recent": {"$each": entries, "$slice": -self.context_window}},
+                "$setOnInsert": {"created_at": now, **self._insert_defaults}
+            },
+            projection=_ALLOCATE_PROJECTION,
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        recent = convo.get("recent") or []
+        complete = len(recent) == min(convo["last_seq"], self.context_window)
+        return convo["last_seq"] - len(messages) + 1, tuple(recent) if complete else None
+
+    @_mongo_op("add_messages", default=False)
+    async def _write_messages(self, messages_by_email: Dict[str, List[Dict]], now: Optional[datetime] = None) -> bool:
+        """Insert messages for one or more users with a single unordered insert_many."""
+        now = now or datetime.utcnow()
+        docs = []
+        windows = {}
+        for email, messages in messages_by_email.items():
+            if not messages:
+                continue
+            first_seq, windows[email] = await self._allocate_seq(email, messages, now)
+            docs.extend(
                 {
-                    "$push": {"messages": {"$each": [user_msg, assistant_msg]}},
-                    "$set": {"updated_at": datetime.utcnow()},
-                    "$setOnInsert": {"created_at": datetime.utcnow(), "context_window": self.context_window}
-                },
-                upsert=True
+                    "email": email,
+                    "seq": seq,
+                    "role": msg["role"],
+                    "content": msg["content"],
+                    "timestamp": msg.get("timestamp") or now
+                }
+                for seq, msg in enumerate(messages, start=first_seq)
             )
-            
-            if result.upserted_id:
-                logger.info(f"Created new conversation document for email: {email}")
-            elif result.modified_count > 0:
-                logger.info(f"Updated existing conversation for email: {email}")
-            else:
-                logger.warning(f"No changes made to conversation for email: {email}")
-            
+        if not docs:
             return True
-                
-        except Exception as e:
-            logger.error(f"Error adding conversation turn to MongoDB: {str(e)}")
-            return False
+        
+        await self._message_writes.insert_many(docs, ordered=False)
+        logger.debug("Conversation write: %d messages", len(docs))
+        
+        for email, messages in messages_by_email.items():
+            # The window returned by the write is current, so the next read needs no round trip
+            if windows.get(email) is not None:
+                self._local_context[email] = windows[email]
+            else:
+                self._local_context.pop(email, None)
+            await self._cache_context(email, [
+                {"role": msg["role"], "content": msg["content"]} for msg in messages
+            ])
+        return True
 
-   
\ No newline at end of file
+    async def iter_conversation(self, email: str, batch_size: int = 100) -> AsyncIterator[Dict]:
+        """Stream a user's stored messages in order, batch_size documents per round trip."""
+        try:
+            cursor = async_db.conversation_messages.find(
+                {"email": email},
+                _MESSAGE_PROJECTION
+            ).sort("seq", 1).batch_size(batch_size)
+            async for message in cursor:
+                yield message
+        except Exception as e:
+            logger.error(f"Error streaming conversation from MongoDB: {str(e)}")
@@ -1,49 +1,118 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime, date, time, timedelta
 from ..models.doctor_availability import (
     WeeklySchedule, DoctorAvailabilityModel, TimeSlot,
-    DailyOverride, BlockTimeSlot, BlockTimeReason
+    DailyOverride, BlockTimeSlot, BlockTimeReason, DAY_NAMES
 )
 from ..models.appointment import AppointmentSlot
 from ..database import db
+from ..config import CLEANUP_DUPLICATE_SLOTS
+from cachetools import TTLCache
+from copy import deepcopy
+import threading
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _interval_mask(start: time, end: time) -> int:
+    """Bitmask of the minutes of the day covered by [start, end)"""
+    start_minute = start.hour * 60 + start.minute
+    end_minute = end.hour * 60 + end.minute
+    return ((1 << max(end_minute - start_minute, 0)) - 1) << start_minute
+
+def _blocked_mask(block_times: List[Dict]) -> int:
+    """Bitmask of every minute covered by a day's block times"""
+    mask = 0
+    for block_time in block_times:
+        mask |= _interval_mask(time.fromisoformat(block_time["start_time"]), time.fromisoformat(block_time["end_time"]))
+    return mask
+
+# Index setup runs once per process, however many services are constructed
+_indexes_created = False
+_indexes_lock = threading.Lock()
+
 class DoctorAvailabilityService:
     """Business logic for doctor availability management"""
     
     def __init__(self):
         self.availability_model = DoctorAvailabilityModel()
+        # Weekly schedules by doctor_email; cleared whenever a schedule is written. Only
+        # existing schedules are stored, and callers always get their own copy
+        self._schedule_cache: TTLCache = TTLCache(maxsize=1024, ttl=60)
+        self._schedule_cache_lock = threading.Lock()
+        # Slot boundaries by (start_time, end_time, duration); schedules repeat across days
+        self._slot_times_cache: Dict[Tuple[str, str, int], Tuple[Tuple[time, time, int], ...]] = {}
         self._create_indexes()
     
     def _create_indexes(self):
-        """Create database indexes for performance"""
-        try:
-            db.doctor_schedules.create_index("doctor_email", unique=True)
-            db.appointment_slots.create_index([("doctor_email", 1), ("slot_date", 1)])
-            db.appointment_slots.create_index([("doctor_email", 1), ("slot_date", 1), ("slot_time", 1)], unique=True)
-            db.appointment_slots.create_index([("slot_date", 1), ("is_available", 1)])
-            db.daily_overrides.create_index([("doctor_email", 1), ("override_date", 1)], unique=True)
-            db.daily_overrides.create_index([("override_date", 1)])
-            logger.info("Database indexes created for availability system")
-            
-            # Clean up any existing duplicate slots
-            self._cleanup_duplicate_slots()
-        except Exception as e:
-            logger.error(f"Error creating indexes: {str(e)}")
+        """
+        Create database indexes for performance; once every step has succeeded in a
+        process, later calls do nothing. Each step handles its own errors, so a failing
+        index doesn't skip the rest, and a later construction retries.
+        """
+        global _indexes_created
+        with _indexes_lock:
+            if _indexes_created:
+                return
+            
+            steps = (
+                ("doctor_schedules doctor_email index",
+                 lambda: db.doctor_schedules.create_index("doctor_email", unique=True)),
+                ("appointment_slots doctor_email/slot_date index",
+                 lambda: db.appointment_slots.create_index([("doctor_email", 1), ("slot_date", 1)])),
+                # Slots are keyed by their start as a BSON date; fill it in for slots written before it existed
+                ("slot_start backfill", lambda: db.appointment_slots.update_many(
+                    {"slot_start": {"$exists": False}},
+                    [{"$set": {"slot_start": {"$dateFromString": {
+                        "dateString": {"$concat": ["$slot_date", "T", "$slot_time"]}
+                    }}}}]
+                )),
+                # Full-collection scan, so only run when explicitly asked for
+                ("duplicate slot cleanup",
+                 lambda: self._cleanup_duplicate_slots() if CLEANUP_DUPLICATE_SLOTS else None),
+                ("legacy slot index drop", self._drop_legacy_slot_index),
+                ("appointment_slots doctor_email/slot_start unique index",
+                 lambda: db.appointment_slots.create_index([("doctor_email", 1), ("slot_start", 1)], unique=True)),
+                # Covers get_available_slots: equality fields, then the slot_start range, then the projection
+                ("available_slots_covering index", lambda: db.appointment_slots.create_index([
+                    ("doctor_email", 1), ("is_available", 1), ("slot_start", 1),
+                    ("slot_date", 1), ("slot_time", 1), ("appointment_id", 1)
+                ], name="available_slots_covering")),
+                ("appointment_slots slot_date/is_available index",
+                 lambda: db.appointment_slots.create_index([("slot_date", 1), ("is_available", 1)])),
+                ("daily_overrides doctor_email/override_date index",
+                 lambda: db.daily_overrides.create_index([("doctor_email", 1), ("override_date", 1)], unique=True)),
+                ("daily_overrides override_date index",
+                 lambda: db.daily_overrides.create_index([("override_date", 1)])),
+            )
+            
+            succeeded = True
+            for name, step in steps:
+                try:
+                    step()
+                except Exception as e:
+                    succeeded = False
+                    logger.error(f"Error creating {name}: {str(e)}")
+            
+            _indexes_created = succeeded
+            if succeeded:
+                logger.info("Database indexes created for availability system")
+    
+    def _drop_legacy_slot_index(self):
+        """Drop the slot index keyed by date and time strings, superseded by slot_start"""
+        if "doctor_email_1_slot_date_1_slot_time_1" in db.appointment_slots.index_information():
+            db.appointment_slots.drop_index("doctor_email_1_slot_date_1_slot_time_1")
     
     def _cleanup_duplicate_slots(self):
         """Remove duplicate appointment slots"""
         try:
-            # Find and remove duplicate slots
+            # Collect the ids of every duplicate but the first of each group, server-side
             pipeline = [
                 {
                     "$group": {
                         "_id": {
                             "doctor_email": "$doctor_email",
-                            "slot_date": "$slot_date",
-                            "slot_time": "$slot_time"
+                            "slot_start": "$slot_start"
                         },
                         "duplicates": {"$push": "$_id"},
                         "count": {"$sum": 1}
@@ -53,17 +122,17 @@ class DoctorAvailabilityService:
                     "$match": {
                         "count": {"$gt": 1}
                     }
-                }
+                },
+                {"$project": {"ids_to_delete": {"$slice": ["$duplicates", 1, {"$size": "$duplicates"}]}}},
+                {"$unwind": "$ids_to_delete"},
+                {"$group": {"_id": None, "ids": {"$push": "$ids_to_delete"}}}
             ]
             
-            duplicates = list(db.appointment_slots.aggregate(pipeline))
+            result = next(db.appointment_slots.aggregate(pipeline, allowDiskUse=True), None)
             
-            for duplicate in duplicates:
-                # Keep the first one, remove the rest
-                duplicate_ids = duplicate["duplicates"][1:]  # Skip the first one
-                if duplicate_ids:
-                    db.appointment_slots.delete_many({"_id": {"$in": duplicate_ids}})
-                    logger.info(f"Removed {len(duplicate_ids)} duplicate slots for {duplicate['_id']['doctor_email']} on {duplicate['_id']['slot_date']} at {duplicate['_id']['slot_time']}")
+            if result and result["ids"]:
+                deleted = db.appointment_slots.delete_many({"_id": {"$in": result["ids"]}})
+                logger.info(f"Removed {deleted.deleted_count} duplicate slots")
                     
         except Exception as e:
             logger.error(f"Error cleaning up duplicate slots: {str(e)}")
@@ -73,6 +142,7 @@ class DoctorAvailabilityService:
         try:
             # Save weekly schedule
             result = self.availability_model.create_weekly_schedule(schedule_data)
+            self._invalidate_weekly_schedule(schedule_data.doctor_email)
             
             if result["success"]:
                 # Generate slots for next 30 days
@@ -87,44 +157,38 @@ class DoctorAvailabilityService:
     def get_weekly_schedule(self, doctor_email: str) -> Optional[Dict]:
         """Get doctor's weekly schedule"""
         try:
-            return self.availability_model.get_weekly_schedule(doctor_email)
+            with self._schedule_cache_lock:
+                cached = self._schedule_cache.get(doctor_email)
+            if cached is not None:
+                return deepcopy(cached)
+            schedule = self.availability_model.get_weekly_schedule(doctor_email)
+            # A missing schedule isn't cached, so one created elsewhere shows up right away
+            if schedule is not None:
+                with self._schedule_cache_lock:
+                    self._schedule_cache[doctor_email] = deepcopy(schedule)
+            return schedule
         except Exception as e:
             logger.error(f"Error getting weekly schedule: {str(e)}")
             return None
     
+    def _invalidate_weekly_schedule(self, doctor_email: str):
+        """Drop a doctor's cached weekly schedule after it changes"""
+        with self._schedule_cache_lock:
+            self._schedule_cache.pop(doctor_email, None)
+    
     def get_available_slots(self, doctor_email: str, start_date: date, end_date: date) -> List[Dict]:
         """Get available appointment slots for a date range"""
         try:
             logger.info(f"Getting available slots for {doctor_email} from {start_date} to {end_date}")
             
-            # Check if doctor has set their weekly schedule
-            weekly_schedule = self.get_weekly_schedule(doctor_email)
-            if not weekly_schedule:
-                logger.info(f"No weekly schedule found for doctor: {doctor_email}")
+            # Make sure slots exist for the period; also tells us whether the doctor has a schedule
+            if not self._ensure_slots_generated(doctor_email, start_date, end_date):
                 return []
             
-            logger.info(f"Weekly schedule found for {doctor_email}")
-            
-            # First, ensure slots are generated for the requested period
-            self._ensure_slots_generated(doctor_email, start_date, end_date)
-            
-            # Get available slots
+            # Already projected to the fields the API returns
             slots = self.availability_model.get_available_slots(doctor_email, start_date, end_date)
             logger.info(f"Found {len(slots)} slots for {doctor_email}")
-            
-            # Format slots for API response
-            formatted_slots = []
-            for slot in slots:
-                formatted_slots.append({
-                    "doctor_email": slot["doctor_email"],
-                    "slot_date": slot["slot_date"],
-                    "slot_time": slot["slot_time"],
-                    "is_available": slot["is_available"],
-                    "appointment_id": slot.get("appointment_id")
-                })
-            
-            logger.info(f"Returning {len(formatted_slots)} formatted slots for {doctor_email}")
-            return formatted_slots
+            return slots
         except Exception as e:
             logger.error(f"Error getting available slots: {str(e)}")
             return []
@@ -154,123 +218,152 @@ class DoctorAvailabilityService:
                 logger.warning(f"No weekly schedule found for doctor: {doctor_email}")
                 return
             
-            current_date = start_date
-            while current_date <= end_date:
-                day_name = current_date.strftime('%A').lower()
-                
-                # Check if doctor is available on this day
-                day_schedule = weekly_schedule.get(day_name)
-                if day_schedule and day_schedule.get("is_available", False):
-                    # Generate slots for this day
-                    self._generate_slots_for_day(doctor_email, current_date, day_schedule)
-                
-                current_date += timedelta(days=1)
+            # Days that already have slots are left alone; one query for the whole period
+            existing_dates = self._dates_with_slots(doctor_email, start_date, end_date)
+            
+            all_slots = self._build_slots_for_period(doctor_email, weekly_schedule, start_date, end_date, existing_dates)
+            
+            # Save the whole period in a single bulk write
+            if all_slots:
+                inserted = self.availability_model.insert_appointment_slots(all_slots)
+                logger.info(f"Generated {inserted} slots for {doctor_email} from {start_date} to {end_date}")
                 
         except Exception as e:
             logger.error(f"Error generating slots for period: {str(e)}")
     
-    def _generate_slots_for_day(self, doctor_email: str, slot_date: date, day_schedule: Dict):
-        """Generate slots for a specific day"""
-        try:
-            from datetime import datetime
-            
-            # Handle both HH:MM and HH:MM:SS formats
-            start_time_str = day_schedule["start_time"]
-            end_time_str = day_schedule["end_time"]
-            
-            # Try HH:MM:SS format first, then HH:MM
-            try:
-                start_time = datetime.strptime(start_time_str, '%H:%M:%S').time()
-            except ValueError:
-                start_time = datetime.strptime(start_time_str, '%H:%M').time()
-            
-            try:
-                end_time = datetime.strptime(end_time_str, '%H:%M:%S').time()
-            except ValueError:
-                end_time = datetime.strptime(end_time_str, '%H:%M').time()
-            slot_duration = day_schedule.get("slot_duration_minutes", 30)
-            
-            # Check if slots already exist for this day
-            existing_slots = list(db.appointment_slots.find({
+    def _dates_with_slots(self, doctor_email: str, start_date: date, end_date: date) -> set:
+        """ISO dates in a range that already have slots.
+
+        Answered from the (doctor_email, slot_date) index alone: the filter and the
+        distinct key are both index fields, so no slot documents are fetched.
+        """
+        return set(db.appointment_slots.distinct("slot_date", {
+            "doctor_email": doctor_email,
+            "slot_date": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()}
+        }))
+    
+    def _build_slots_for_period(self, doctor_email: str, weekly_schedule: Dict, start_date: date, end_date: date, skip_dates=()) -> List[Dict]:
+        """Build the slot documents for every available day in a period, skipping skip_dates"""
+        slots = []
+        current_date = start_date
+        while current_date <= end_date:
+            day_name = DAY_NAMES[current_date.weekday()]
+            
+            # Check if doctor is available on this day
+            day_schedule = weekly_schedule.get(day_name)
+            if day_schedule and day_schedule.get("is_available", False) and current_date.isoformat() not in skip_dates:
+                slots.extend(self._build_slots_for_day(doctor_email, current_date, day_schedule))
+            
+            current_date += timedelta(days=1)
+        return slots
+    
+    def _build_slots_for_day(self, doctor_email: str, slot_date: date, day_schedule: Dict) -> List[Dict]:
+        """Build the slot documents for a day from its weekly schedule entry"""
+        slot_times = self._compute_slot_times(
+            day_schedule["start_time"], day_schedule["end_time"], day_schedule.get("slot_duration_minutes", 30)
+        )
+        
+        slot_date_str = slot_date.isoformat()
+        created_at = datetime.utcnow()
+        return [
+            {
                 "doctor_email": doctor_email,
-                "slot_date": slot_date.isoformat()
-            }, {"_id": 0}))
-            
-            if existing_slots:
-                logger.info(f"Slots already exist for {doctor_email} on {slot_date}")
-                return
-            
-            # Generate slots
-            slots = []
-            current_time = start_time
-            
-            while current_time < end_time:
-                # Calculate end time for this slot
-                slot_start = current_time
-                slot_end = self._add_minutes_to_time(current_time, slot_duration)
-                
-                if slot_end <= end_time:
-                    slot = {
-                        "doctor_email": doctor_email,
-                        "slot_date": slot_date.isoformat(),
-                        "slot_time": slot_start,
-                        "is_available": True,
-                        "appointment_id": None,
-                        "created_at": datetime.utcnow()
-                    }
-                    slots.append(slot)
-                
-                current_time = slot_end
-            
-            # Save slots to database
-            if slots:
-                self.availability_model.create_appointment_slots(doctor_email, slot_date, slots)
-                logger.info(f"Generated {len(slots)} slots for {doctor_email} on {slot_date}")
-                
-        except Exception as e:
-            logger.error(f"Error generating slots for day: {str(e)}")
+                "slot_date": slot_date_str,
+                "slot_time": slot_start.isoformat(),
+                "slot_start": datetime.combine(slot_date, slot_start),
+                "is_available": True,
+                "appointment_id": None,
+                "created_at": created_at
+            }
+            for slot_start, _, _ in slot_times
+        ]
+    
+    def _compute_slot_times(self, start_time_str: str, end_time_str: str, slot_duration: int) -> Tuple[Tuple[time, time, int], ...]:
+        """(start, end, minute mask) of every slot between two times; computed once per (start, end, duration)"""
+        key = (start_time_str, end_time_str, slot_duration)
+        slot_times = self._slot_times_cache.get(key)
+        if slot_times is not None:
+            return slot_times
+        
+        # Handle both HH:MM and HH:MM:SS formats
+        try:
+            start_time = datetime.strptime(start_time_str, '%H:%M:%S').time()
+        except ValueError:
+            start_time = datetime.strptime(start_time_str, '%H:%M').time()
+        
+        try:
+            end_time = datetime.strptime(end_time_str, '%H:%M:%S').time()
+        except ValueError:
+            end_time = datetime.strptime(end_time_str, '%H:%M').time()
+        
+        slots = []
+        current_time = start_time
+        while current_time < end_time:
+            # Calculate end time for this slot
+            slot_end = self._add_minutes_to_time(current_time, slot_duration)
+            # Stop on a zero duration or a slot that wraps past midnight
+            if slot_end <= current_time:
+                break
+            if slot_end <= end_time:
+                slots.append((current_time, slot_end, _interval_mask(current_time, slot_end)))
+            current_time = slot_end
+        
+        slot_times = tuple(slots)
+        self._slot_times_cache[key] = slot_times
+        return slot_times
     
-    def _ensure_slots_generated(self, doctor_email: str, start_date: date, end_date: date):
-        """Ensure slots are generated for the requested period"""
+    def _ensure_slots_generated(self, doctor_email: str, start_date: date, end_date: date) -> bool:
+        """Ensure slots are generated for the requested period; False if the doctor has no weekly schedule"""
         try:
             logger.info(f"Ensuring slots generated for {doctor_email} from {start_date} to {end_date}")
             
             # Get doctor's weekly schedule first
             weekly_schedule = self.get_weekly_schedule(doctor_email)
             if not weekly_schedule:
-                logger.warning(f"No weekly schedule found for doctor: {doctor_email}")
-                return
+                logger.info(f"No weekly schedule found for doctor: {doctor_email}")
+                return False
             
+            # Dates that already have slots, fetched once for the whole range
+            existing_dates = self._dates_with_slots(doctor_email, start_date, end_date)
+            
+            new_slots = []
+            dates_to_clear = []
             current_date = start_date
             while current_date <= end_date:
-                day_name = current_date.strftime('%A').lower()
+                day_name = DAY_NAMES[current_date.weekday()]
                 day_schedule = weekly_schedule.get(day_name)
+                is_available = bool(day_schedule and day_schedule.get("is_available", False))
+                has_slots = current_date.isoformat() in existing_dates
                 
-                # Check if slots exist for this date
-                existing_slots = list(db.appointment_slots.find({
-                    "doctor_email": doctor_email,
-                    "slot_date": current_date.isoformat()
-                }, {"_id": 0}))
-                
-                logger.info(f"Date {current_date} ({day_name}): available={day_schedule and day_schedule.get('is_available', False)}, existing_slots={len(existing_slots)}")
+                logger.debug(f"Date {current_date} ({day_name}): available={is_available}, has_slots={has_slots}")
                 
                 # If doctor is available on this day and no slots exist, generate them
-                if day_schedule and day_schedule.get("is_available", False) and not existing_slots:
-                    logger.info(f"Generating slots for {doctor_email} on {current_date}")
-                    self._generate_slots_for_day(doctor_email, current_date, day_schedule)
+                if is_available and not has_slots:
+                    new_slots.extend(self._build_slots_for_day(doctor_email, current_date, day_schedule))
                 # If doctor is not available on this day but slots exist, remove them
-                elif (not day_schedule or not day_schedule.get("is_available", False)) and existing_slots:
-                    result = db.appointment_slots.delete_many({
-                        "doctor_email": doctor_email,
-                        "slot_date": current_date.isoformat()
-                    })
-                    if result.deleted_count > 0:
-                        logger.info(f"Removed {result.deleted_count} slots for {doctor_email} on {current_date} - not available")
+                elif not is_available and has_slots:
+                    dates_to_clear.append(current_date.isoformat())
                 
                 current_date += timedelta(days=1)
+            
+            if new_slots:
+                inserted = self.availability_model.insert_appointment_slots(new_slots)
+                logger.info(f"Generated {inserted} slots for {doctor_email} from {start_date} to {end_date}")
+            
+            if dates_to_clear:
+                result = db.appointment_slots.delete_many({
+                    "doctor_email": doctor_email,
+                    "slot_date": {"$in": dates_to_clear}
+                })
+                if result.deleted_count > 0:
+                    logger.info(f"Removed {result.deleted_count} slots for {doctor_email} on {len(dates_to_clear)} unavailable days")
+            
+            return True
                 
         except Exception as e:
             logger.error(f"Error ensuring slots generated: {str(e)}")
+            # The schedule exists; still serve whatever slots are already stored
+            return True
     
     def cleanup_doctor_slots(self, doctor_email: str) -> Dict:
         """Clean up all slots for a doctor and regenerate based on current weekly schedule"""
@@ -290,18 +383,17 @@ class DoctorAvailabilityService:
                 }
             
             # Generate new slots for next 30 days
-            from datetime import timedelta
             end_date = date.today() + timedelta(days=30)
             self._generate_slots_for_period(doctor_email, date.today(), end_date)
             
             # Count generated slots
-            generated_slots = list(db.appointment_slots.find({"doctor_email": doctor_email}))
+            slots_generated = db.appointment_slots.count_documents({"doctor_email": doctor_email})
             
             return {
                 "success": True,
                 "message": f"Successfully cleaned up and regenerated slots for {doctor_email}",
                 "slots_removed": result.deleted_count,
-                "slots_generated": len(generated_slots)
+                "slots_generated": slots_generated
             }
             
         except Exception as e:
@@ -312,28 +404,26 @@ class DoctorAvailabilityService:
             }
     
     def _add_minutes_to_time(self, time_obj: time, minutes: int) -> time:
-        """Add minutes to a time object"""
-        from datetime import datetime, timedelta
-        
-        dt = datetime.combine(date.today(), time_obj)
-        new_dt = dt + timedelta(minutes=minutes)
-        return new_dt.time()
+        """Add minutes to a time object, wrapping at midnight"""
+        total = time_obj.hour * 60 + time_obj.minute + minutes
+        return time(total // 60 % 24, total % 60, time_obj.second)
     
     def update_weekly_schedule(self, doctor_email: str, schedule_data: WeeklySchedule) -> Dict:
         """Update doctor's weekly schedule and regenerate slots"""
         try:
             # Update weekly schedule
             result = self.availability_model.create_weekly_schedule(schedule_data)
+            self._invalidate_weekly_schedule(doctor_email)
             
             if result["success"]:
-                # Delete existing slots for future dates
-                db.appointment_slots.delete_many({
-                    "doctor_email": doctor_email,
-                    "slot_date": {"$gte": date.today().isoformat()}
-                })
-                
-                # Regenerate slots for next 30 days
-                self._generate_slots_for_period(doctor_email, date.today(), date.today() + timedelta(days=30))
+                # Replace future slots with the next 30 days from the new schedule in one bulk write
+                today = date.today()
+                weekly_schedule = self.get_weekly_schedule(doctor_email) or {}
+                slots = self._build_slots_for_period(doctor_email, weekly_schedule, today, today + timedelta(days=30))
+                self.availability_model.replace_appointment_slots(
+                    {"doctor_email": doctor_email, "slot_date": {"$gte": today.isoformat()}},
+                    slots
+                )
                 logger.info(f"Weekly schedule updated and slots regenerated for {doctor_email}")
             
             return result
@@ -346,6 +436,7 @@ class DoctorAvailabilityService:
         try:
             # Delete weekly schedule
             db.doctor_schedules.delete_one({"doctor_email": doctor_email})
+            self._invalidate_weekly_schedule(doctor_email)
             
             # Delete all future slots
             db.appointment_slots.delete_many({
@@ -398,7 +489,9 @@ class DoctorAvailabilityService:
     def get_day_view(self, doctor_email: str, view_date: date) -> Dict:
         """Get complete day view including weekly schedule, daily overrides, and existing appointments"""
         try:
-            day_view = self.availability_model.get_day_view(doctor_email, view_date)
+            day_view = self.availability_model.get_day_view(
+                doctor_email, view_date, self.get_weekly_schedule(doctor_email)
+            )
             
             # Add computed availability based on weekly schedule and overrides
             day_view["computed_availability"] = self._compute_day_availability(
@@ -483,30 +576,21 @@ class DoctorAvailabilityService:
             # Get base available slots
             base_slots = self.get_available_slots(doctor_email, start_date, end_date)
             
-            # Apply overrides to filter out blocked times
+            # Blocked minutes per date, built once per override
+            blocked_masks = {
+                override["override_date"]: _blocked_mask(override.get("block_time_slots", []))
+                for override in overrides
+            }
+            
+            # Apply overrides to filter out slots starting inside a blocked minute
             filtered_slots = []
             for slot in base_slots:
-                slot_date = datetime.strptime(slot["slot_date"], "%Y-%m-%d").date()
-                slot_time = datetime.strptime(slot["slot_time"], "%H:%M:%S").time()
-                
-                # Check if this slot is blocked by any override
-                is_blocked = False
-                for override in overrides:
-                    if override["override_date"] == slot_date.isoformat():
-                        # Check block time slots
-                        for block_slot in override.get("block_time_slots", []):
-                            block_start = datetime.strptime(block_slot["start_time"], "%H:%M:%S").time()
-                            block_end = datetime.strptime(block_slot["end_time"], "%H:%M:%S").time()
-                            
-                            if block_start <= slot_time < block_end:
-                                is_blocked = True
-                                break
-                        
-                        if is_blocked:
-                            break
-                
-                if not is_blocked:
-                    filtered_slots.append(slot)
+                blocked = blocked_masks.get(slot["slot_date"])
+                if blocked:
+                    slot_time = time.fromisoformat(slot["slot_time"])
+                    if blocked >> (slot_time.hour * 60 + slot_time.minute) & 1:
+                        continue
+                filtered_slots.append(slot)
             
             return filtered_slots
             
@@ -517,7 +601,7 @@ class DoctorAvailabilityService:
     def _compute_day_availability(self, doctor_email: str, view_date: date, weekly_schedule: Dict, daily_override: Dict) -> Dict:
         """Compute the actual availability for a specific day considering weekly schedule and overrides"""
         try:
-            day_name = view_date.strftime('%A').lower()
+            day_name = DAY_NAMES[view_date.weekday()]
             
             # Start with weekly schedule
             base_availability = {
@@ -560,89 +644,71 @@ class DoctorAvailabilityService:
     
     def _regenerate_slots_for_date(self, doctor_email: str, slot_date: date):
         """Regenerate appointment slots for a specific date considering overrides"""
+        self._regenerate_slots_for_dates(doctor_email, [slot_date])
+    
+    def _regenerate_slots_for_dates(self, doctor_email: str, dates: List[date]):
+        """Regenerate appointment slots for several dates considering overrides.
+
+        Reads the weekly schedule once and every override with one query, then
+        replaces the slots of all dates in a single bulk write.
+        """
         try:
-            # Delete existing slots for this date
-            db.appointment_slots.delete_many({
-                "doctor_email": doctor_email,
-                "slot_date": slot_date.isoformat()
-            })
-            
-            # Get day view to determine actual availability
-            day_view = self.get_day_view(doctor_email, slot_date)
-            computed_availability = day_view.get("computed_availability", {})
+            weekly_schedule = self.get_weekly_schedule(doctor_email) or {}
+            overrides = {
+                override["override_date"]: override
+                for override in self.availability_model.get_daily_overrides_for_dates(doctor_email, dates)
+            }
+            slot_duration = weekly_schedule.get("slot_duration_minutes", 30)
             
-            if computed_availability.get("is_available", False):
+            slots = []
+            for slot_date in dates:
+                computed_availability = self._compute_day_availability(
+                    doctor_email, slot_date, weekly_schedule, overrides.get(slot_date.isoformat())
+                )
+                if not computed_availability.get("is_available", False):
+                    continue
+                
                 # Generate slots based on computed availability
                 start_time_str = computed_availability.get("start_time")
                 end_time_str = computed_availability.get("end_time")
-                
                 if start_time_str and end_time_str:
-                    # Get weekly schedule for slot duration
-                    weekly_schedule = day_view.get("weekly_schedule", {})
-                    slot_duration = weekly_schedule.get("slot_duration_minutes", 30)
-                    
-                    # Generate slots
-                    self._generate_slots_for_day_with_overrides(
+                    slots.extend(self._build_slots_for_day_with_overrides(
                         doctor_email, slot_date, start_time_str, end_time_str, 
                         slot_duration, computed_availability.get("block_times", [])
-                    )
-                    
-        except Exception as e:
-            logger.error(f"Error regenerating slots for date: {str(e)}")
-    
-    def _generate_slots_for_day_with_overrides(self, doctor_email: str, slot_date: date, start_time_str: str, end_time_str: str, slot_duration: int, block_times: List[Dict]):
-        """Generate slots for a day considering block times"""
-        try:
-            from datetime import datetime
-            
-            # Parse times
-            try:
-                start_time = datetime.strptime(start_time_str, '%H:%M:%S').time()
-            except ValueError:
-                start_time = datetime.strptime(start_time_str, '%H:%M').time()
-            
-            try:
-                end_time = datetime.strptime(end_time_str, '%H:%M:%S').time()
-            except ValueError:
-                end_time = datetime.strptime(end_time_str, '%H:%M').time()
+                    ))
             
-            # Generate slots
-            slots = []
-            current_time = start_time
-            
-            while current_time < end_time:
-                slot_start = current_time
-                slot_end = self._add_minutes_to_time(current_time, slot_duration)
-                
-                if slot_end <= end_time:
-                    # Check if this slot overlaps with any block time
-                    is_blocked = False
-                    for block_time in block_times:
-                        block_start = datetime.strptime(block_time["start_time"], '%H:%M:%S').time()
-                        block_end = datetime.strptime(block_time["end_time"], '%H:%M:%S').time()
-                        
-                        # Check for overlap
-                        if (slot_start < block_end and slot_end > block_start):
-                            is_blocked = True
-                            break
+            # Delete the dates' slots and insert the regenerated ones in one bulk write
+            inserted = self.availability_model.replace_appointment_slots(
+                {"doctor_email": doctor_email, "slot_date": {"$in": [d.isoformat() for d in dates]}},
+                slots
+            )
+            if inserted:
+                logger.info(f"Generated {inserted} slots for {doctor_email} on {len(dates)} dates with block time considerations")
                     
-                    if not is_blocked:
-                        slot = {
-                            "doctor_email": doctor_email,
-                            "slot_date": slot_date.isoformat(),
-                            "slot_time": slot_start,
-                            "is_available": True,
-                            "appointment_id": None,
-                            "created_at": datetime.utcnow()
-                        }
-                        slots.append(slot)
-                
-                current_time = slot_end
-            
-            # Save slots to database
-            if slots:
-                self.availability_model.create_appointment_slots(doctor_email, slot_date, slots)
-                logger.info(f"Generated {len(slots)} slots for {doctor_email} on {slot_date} with block time considerations")
-                
         except Exception as e:
-            logger.error(f"Error generating slots for day with overrides: {str(e)}")
+            logger.error(f"Error regenerating slots for dates: {str(e)}")
+    
+    def _build_slots_for_day_with_overrides(self, doctor_email: str, slot_date: date, start_time_str: str, end_time_str: str, slot_duration: int, block_times: List[Dict]) -> List[Dict]:
+        """Build the slot documents for a day considering block times"""
+        # One bit per blocked minute of the day; a slot overlaps a block if the masks intersect
+        blocked = _blocked_mask(block_times)
+        
+        # Generate slots
+        slots = []
+        slot_date_str = slot_date.isoformat()
+        created_at = datetime.utcnow()
+        
+        for slot_start, _, slot_mask in self._compute_slot_times(start_time_str, end_time_str, slot_duration):
+            if slot_mask & blocked:
+                continue
+            slots.append({
+                "doctor_email": doctor_email,
+                "slot_date": slot_date_str,
+                "slot_time": slot_start.isoformat(),
+                "slot_start": datetime.combine(slot_date, slot_start),
+                "is_available": True,
+                "appointment_id": None,
+                "created_at": created_at
+            })
+        
+        return slots
@@ -1,32 +1,152 @@
 from typing import List, Dict, Optional
+from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
 import logging
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import aiosmtplib
+from email.message import EmailMessage
+from string import Template
 import os
 from dotenv import load_dotenv
 import asyncio
+import socket
+from html import escape
 from ..models.appointment import AppointmentReminder, AppointmentResponse, AppointmentStatus
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Email bodies, parsed once at import time
+_CONFIRMATION_TEMPLATE = Template("""
+        <html>
+        <body>
+            <h2>Appointment Confirmed</h2>
+            <p>Dear Patient,</p>
+            <p>Your appointment has been confirmed with the following details:</p>
+            <ul>
+                <li><strong>Date:</strong> ${appointment_date}</li>
+                <li><strong>Time:</strong> ${appointment_time}</li>
+                <li><strong>Duration:</strong> ${duration_minutes} minutes</li>
+                <li><strong>Type:</strong> ${appointment_type}</li>
+                <li><strong>Urgency:</strong> ${urgency_level}</li>
+            </ul>
+            <p>Please arrive 10 minutes before your scheduled time.</p>
+            <p>If you need to reschedule or cancel, please contact us as soon as possible.</p>
+            <p>Best regards,<br>${app_name} Team</p>
+        </body>
+        </html>
+        """)
+
+_REMINDER_24H_TEMPLATE = Template("""
+        <html>
+        <body>
+            <h2>Appointment Reminder - Tomorrow</h2>
+            <p>Dear Patient,</p>
+            <p>This is a reminder that you have an appointment tomorrow:</p>
+            <ul>
+                <li><strong>Date:</strong> ${appointment_date}</li>
+                <li><strong>Time:</strong> ${appointment_time}</li>
+                <li><strong>Duration:</strong> ${duration_minutes} minutes</li>
+            </ul>
+            <p>Please prepare any relevant medical documents or questions you may have.</p>
+            <p>If you need to reschedule, please contact us immediately.</p>
+            <p>Best regards,<br>${app_name} Team</p>
+        </body>
+        </html>
+        """)
+
+_REMINDER_1H_TEMPLATE = Template("""
+        <html>
+        <body>
+            <h2>Appointment Starting Soon</h2>
+            <p>Dear Patient,</p>
+            <p>Your appointment is scheduled to start in 1 hour:</p>
+            <ul>
+                <li><strong>Time:</strong> ${appointment_time}</li>
+                <li><strong>Duration:</strong> ${duration_minutes} minutes</li>
+            </ul>
+            <p>Please ensure you are ready and have all necessary documents.</p>
+            <p>Best regards,<br>${app_name} Team</p>
+        </body>
+        </html>
+        """)
+
+_CANCELLATION_TEMPLATE = Template("""
+        <html>
+        <body>
+            <h2>Appointment Cancelled</h2>
+            <p>Dear Patient,</p>
+            <p>Your appointment has been cancelled:</p>
+            <ul>
+                <li><strong>Date:</strong> ${appointment_date}</li>
+                <li><strong>Time:</strong> ${appointment_time}</li>
+            </ul>
+            <p>If you need to reschedule, please contact us to book a new appointment.</p>
+            <p>Best regards,<br>${app_name} Team</p>
+        </body>
+        </html>
+        """)
+
+_MEDICATION_REMINDER_TEMPLATE = Template("""
+        <html>
+        <body>
+            <h2>Medication Reminder</h2>
+            <p>Dear Patient,</p>
+            <p>Please remember to take your prescribed medications:</p>
+            <ul>
+                ${medication_list}
+            </ul>
+            <p>Your next appointment is scheduled for ${appointment_date} at ${appointment_time}.</p>
+            <p>If you have any questions about your medications, please contact your doctor.</p>
+            <p>Best regards,<br>${app_name} Team</p>
+        </body>
+        </html>
+        """)
+
+class _PooledSMTP:
+    """One member of the SMTP connection pool and the messages sent on its current connection."""
+    def __init__(self):
+        self.client: Optional[aiosmtplib.SMTP] = None
+        self.sent = 0
+
 class NotificationService:
+    """
+    Appointment emails over a pooled SMTP connection, plus scheduled reminders.
+    Use the shared instance from get_notification_service(); the application's
+    shutdown hook closes its pool. No route sends notifications yet, so the
+    service stays dormant (and opens no connections) until a caller uses it.
+    """
     def __init__(self):
         self.smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
         self.smtp_port = int(os.getenv("SMTP_PORT", "587"))
         self.smtp_username = os.getenv("SMTP_USERNAME")
         self.smtp_password = os.getenv("SMTP_PASSWORD")
         self.from_email = os.getenv("FROM_EMAIL", "noreply@healthmate.com")
+        self.smtp_timeout = float(os.getenv("SMTP_TIMEOUT", "10"))
+        # SMTP server addresses (IPv4 and IPv6), resolved on first connect and reused
+        # for reconnects; the last one that connected is tried first
+        self._smtp_addresses: Optional[List[str]] = None
         self.app_name = "HealthMate"
         
-        # In-memory storage for sent reminders (replace with database in production)
-        self.sent_reminders: Dict[str, AppointmentReminder] = {}
+        # In-memory storage for sent reminders (replace with database in production),
+        # indexed by appointment_id and capped at max_reminders with oldest-first eviction
+        self.sent_reminders: "OrderedDict[str, AppointmentReminder]" = OrderedDict()
+        self._by_appointment: Dict[str, List[AppointmentReminder]] = defaultdict(list)
+        self.max_reminders = int(os.getenv("MAX_SENT_REMINDERS", "100000"))
+        
+        # Pending scheduled reminders; held here so they aren't garbage collected
+        self._reminder_tasks = set()
+        
+        # Pool of authenticated SMTP connections reused across sends, so up to
+        # smtp_pool_size messages are in flight at once; each connection is recycled
+        # every smtp_max_messages messages to stay within provider per-connection limits
+        self.smtp_pool_size = int(os.getenv("SMTP_POOL_SIZE", "5"))
+        self.smtp_max_messages = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+        self._smtp_connections = [_PooledSMTP() for _ in range(self.smtp_pool_size)]
+        self._smtp_pool: asyncio.Queue = asyncio.Queue()
+        for connection in self._smtp_connections:
+            self._smtp_pool.put_nowait(connection)
 
     async def send_appointment_confirmation(self, appointment: AppointmentResponse) -> bool:
         """
@@ -54,7 +174,7 @@ class NotificationService:
                     message=message,
                     sent_at=datetime.now()
                 )
-                self.sent_reminders[f"{appointment.id}_confirmation"] = reminder
+                self._record_reminder(f"{appointment.id}_confirmation", reminder)
                 
                 logger.info(f"Appointment confirmation sent to {appointment.patient_email}")
             
@@ -90,7 +210,7 @@ class NotificationService:
                     message=message,
                     sent_at=datetime.now()
                 )
-                self.sent_reminders[f"{appointment.id}_24h"] = reminder
+                self._record_reminder(f"{appointment.id}_24h", reminder)
                 
                 logger.info(f"24h appointment reminder sent to {appointment.patient_email}")
             
@@ -126,7 +246,7 @@ class NotificationService:
                     message=message,
                     sent_at=datetime.now()
                 )
-                self.sent_reminders[f"{appointment.id}_1h"] = reminder
+                self._record_reminder(f"{appointment.id}_1h", reminder)
                 
                 logger.info(f"1h appointment reminder sent to {appointment.patient_email}")
             
@@ -188,38 +308,115 @@ class NotificationService:
         Schedule all necessary reminders for an appointment.
         """
         try:
-            # Schedule 24-hour reminder
+            # Seconds until the appointment, from a single clock read
             appointment_datetime = datetime.combine(appointment.appointment_date, appointment.appointment_time)
-            reminder_24h_time = appointment_datetime - timedelta(hours=24)
+            seconds_until = (appointment_datetime - datetime.now()).total_seconds()
+            
+            # Schedule 24-hour reminder
+            delay_24h = seconds_until - timedelta(hours=24).total_seconds()
             
             # Schedule 1-hour reminder
-            reminder_1h_time = appointment_datetime - timedelta(hours=1)
+            delay_1h = seconds_until - timedelta(hours=1).total_seconds()
             
-            # Schedule the reminders (in production, use a task queue like Celery)
-            if reminder_24h_time > datetime.now():
-                await self._schedule_reminder(reminder_24h_time, self.send_appointment_reminder_24h, appointment)
+            # Schedule the reminders as background tasks (in production, use a task queue like Celery);
+            # in-process timers do not survive a restart
+            if delay_24h > 0:
+                self._start_reminder_task(delay_24h, self.send_appointment_reminder_24h, appointment)
             
-            if reminder_1h_time > datetime.now():
-                await self._schedule_reminder(reminder_1h_time, self.send_appointment_reminder_1h, appointment)
+            if delay_1h > 0:
+                self._start_reminder_task(delay_1h, self.send_appointment_reminder_1h, appointment)
             
             logger.info(f"Appointment reminders scheduled for {appointment.id}")
             
         except Exception as e:
             logger.error(f"Error scheduling appointment reminders: {str(e)}")
 
-    async def _schedule_reminder(self, reminder_time: datetime, reminder_func, appointment: AppointmentResponse):
+    def _start_reminder_task(self, delay_seconds: float, reminder_func, appointment: AppointmentResponse):
+        """Run _schedule_reminder in the background, keeping a reference until it finishes."""
+        task = asyncio.create_task(self._schedule_reminder(delay_seconds, reminder_func, appointment))
+        self._reminder_tasks.add(task)
+        task.add_done_callback(self._reminder_tasks.discard)
+
+    async def _schedule_reminder(self, delay_seconds: float, reminder_func, appointment: AppointmentResponse):
         """
-        Schedule a reminder to be sent at a specific time.
+        Send a reminder after delay_seconds.
+        asyncio.sleep runs on the loop's monotonic clock, so wall-clock changes don't shift it.
         In production, this would use a proper task scheduler.
         """
         try:
-            delay = (reminder_time - datetime.now()).total_seconds()
-            if delay > 0:
-                await asyncio.sleep(delay)
-                await reminder_func(appointment)
+            await asyncio.sleep(delay_seconds)
+            await reminder_func(appointment)
         except Exception as e:
             logger.error(f"Error in scheduled reminder: {str(e)}")
 
+    async def _close_smtp(self, connection: _PooledSMTP):
+        """Close a pooled SMTP connection, ignoring errors from a dead socket."""
+        if connection.client is not None:
+            try:
+                await connection.client.quit()
+            except (aiosmtplib.SMTPException, OSError):
+                connection.client.close()
+            connection.client = None
+            connection.sent = 0
+
+    async def _get_smtp(self, connection: _PooledSMTP) -> aiosmtplib.SMTP:
+        """Return the pooled connection's live, authenticated client, reconnecting if needed."""
+        if connection.client is not None and connection.sent >= self.smtp_max_messages:
+            await self._close_smtp(connection)
+        
+        if connection.client is not None:
+            try:
+                if connection.client.is_connected and (await connection.client.noop()).code == 250:
+                    return connection.client
+            except (aiosmtplib.SMTPException, OSError):
+                pass
+            await self._close_smtp(connection)
+        
+        if self._smtp_addresses is None:
+            addrinfo = await asyncio.get_running_loop().getaddrinfo(
+                self.smtp_server, self.smtp_port, family=socket.AF_UNSPEC, type=socket.SOCK_STREAM
+            )
+            # Resolver order, without duplicates
+            self._smtp_addresses = list(dict.fromkeys(info[4][0] for info in addrinfo))
+        
+        server = None
+        last_error: Optional[Exception] = None
+        # Iterate a snapshot; other pooled connections may reorder the list meanwhile
+        for address in list(self._smtp_addresses):
+            candidate = aiosmtplib.SMTP(
+                hostname=address, port=self.smtp_port, start_tls=False, timeout=self.smtp_timeout
+            )
+            try:
+                await candidate.connect()
+            except (aiosmtplib.SMTPException, OSError) as e:
+                logger.warning(f"SMTP connect to {address} failed: {str(e)}")
+                last_error = e
+                continue
+            server = candidate
+            # Try the working address first on the next reconnect
+            if self._smtp_addresses and address in self._smtp_addresses:
+                self._smtp_addresses.remove(address)
+                self._smtp_addresses.insert(0, address)
+            break
+        if server is None:
+            # Every address failed and may be stale; resolve again on the next attempt
+            self._smtp_addresses = None
+            raise last_error or OSError(f"No addresses resolved for {self.smtp_server}")
+        # Certificate checks and SNI still use the configured host name
+        await server.starttls(server_hostname=self.smtp_server)
+        await server.login(self.smtp_username, self.smtp_password)
+        connection.client = server
+        connection.sent = 0
+        return server
+
+    async def aclose(self):
+        """Cancel pending reminders and QUIT all pooled SMTP connections; call on application shutdown."""
+        for task in list(self._reminder_tasks):
+            task.cancel()
+        await asyncio.gather(*self._reminder_tasks, return_exceptions=True)
+        for connection in self._smtp_connections:
+            await self._close_smtp(connection)
+
     async def _send_email(self, to_email: str, subject: str, message: str) -> bool:
         """
         Send email using SMTP.
@@ -229,24 +426,32 @@ class NotificationService:
                 logger.warning("SMTP credentials not configured. Email not sent.")
                 return False
             
-            # Create message
-            msg = MIMEMultipart()
+            # Create message; a single text/html part, no multipart wrapper
+            msg = EmailMessage()
             msg['From'] = self.from_email
             msg['To'] = to_email
             msg['Subject'] = subject
-            
-            # Add body to email
-            msg.attach(MIMEText(message, 'html'))
-            
-            # Create SMTP session
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.smtp_username, self.smtp_password)
-            
-            # Send email
-            text = msg.as_string()
-            server.sendmail(self.from_email, to_email, text)
-            server.quit()
+            msg.set_content(message, subtype='html')
+            
+            # Send over a pooled connection; waits here while all of them are busy
+            connection = await self._smtp_pool.get()
+            try:
+                server = await self._get_smtp(connection)
+                await server.send_message(msg)
+                connection.sent += 1
+            except (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPResponseException):
+                # Drop the connection so the next send on it starts from a fresh one
+                await self._close_smtp(connection)
+                raise
+            except asyncio.CancelledError:
+                # A send cancelled mid-transaction leaves the session in an unknown state
+                if connection.client is not None:
+                    connection.client.close()
+                    connection.client = None
+                    connection.sent = 0
+                raise
+            finally:
+                self._smtp_pool.put_nowait(connection)
             
             return True
             
@@ -256,134 +461,148 @@ class NotificationService:
 
     def _create_confirmation_message(self, appointment: AppointmentResponse) -> str:
         """Create HTML confirmation message."""
-        return f"""
-        <html>
-        <body>
-            <h2>Appointment Confirmed</h2>
-            <p>Dear Patient,</p>
-            <p>Your appointment has been confirmed with the following details:</p>
-            <ul>
-                <li><strong>Date:</strong> {appointment.appointment_date}</li>
-                <li><strong>Time:</strong> {appointment.appointment_time}</li>
-                <li><strong>Duration:</strong> {appointment.duration_minutes} minutes</li>
-                <li><strong>Type:</strong> {appointment.appointment_type}</li>
-                <li><strong>Urgency:</strong> {appointment.urgency_level}</li>
-            </ul>
-            <p>Please arrive 10 minutes before your scheduled time.</p>
-            <p>If you need to reschedule or cancel, please contact us as soon as possible.</p>
-            <p>Best regards,<br>{self.app_name} Team</p>
-        </body>
-        </html>
-        """
+        return _CONFIRMATION_TEMPLATE.substitute(
+            appointment_date=appointment.appointment_date,
+            appointment_time=appointment.appointment_time,
+            duration_minutes=appointment.duration_minutes,
+            appointment_type=escape(str(appointment.appointment_type)),
+            urgency_level=escape(str(appointment.urgency_level)),
+            app_name=self.app_name
+        )
 
     def _create_24h_reminder_message(self, appointment: AppointmentResponse) -> str:
         """Create HTML 24-hour reminder message."""
-        return f"""
-        <html>
-        <body>
-            <h2>Appointment Reminder - Tomorrow</h2>
-            <p>Dear Patient,</p>
-            <p>This is a reminder that you have an appointment tomorrow:</p>
-            <ul>
-                <li><strong>Date:</strong> {appointment.appointment_date}</li>
-                <li><strong>Time:</strong> {appointment.appointment_time}</li>
-                <li><strong>Duration:</strong> {appointment.duration_minutes} minutes</li>
-            </ul>
-            <p>Please prepare any relevant medical documents or questions you may have.</p>
-            <p>If you need to reschedule, please contact us immediately.</p>
-            <p>Best regards,<br>{self.app_name} Team</p>
-        </body>
-        </html>
-        """
+        return _REMINDER_24H_TEMPLATE.substitute(
+            appointment_date=appointment.appointment_date,
+            appointment_time=appointment.appointment_time,
+            duration_minutes=appointment.duration_minutes,
+            app_name=self.app_name
+        )
 
     def _create_1h_reminder_message(self, appointment: AppointmentResponse) -> str:
         """Create HTML 1-hour reminder message."""
-        return f"""
-        <html>
-        <body>
-            <h2>Appointment Starting Soon</h2>
-            <p>Dear Patient,</p>
-            <p>Your appointment is scheduled to start in 1 hour:</p>
-            <ul>
-                <li><strong>Time:</strong> {appointment.appointment_time}</li>
-                <li><strong>Duration:</strong> {appointment.duration_minutes} minutes</li>
-            </ul>
-            <p>Please ensure you are ready and have all necessary documents.</p>
-            <p>Best regards,<br>{self.app_name} Team</p>
-        </body>
-        </html>
-        """
+        return _REMINDER_1H_TEMPLATE.substitute(
+            appointment_time=appointment.appointment_time,
+            duration_minutes=appointment.duration_minutes,
+            app_name=self.app_name
+        )
 
     def _create_cancellation_message(self, appointment: AppointmentResponse) -> str:
         """Create HTML cancellation message."""
-        return f"""
-        <html>
-        <body>
-            <h2>Appointment Cancelled</h2>
-            <p>Dear Patient,</p>
-            <p>Your appointment has been cancelled:</p>
-            <ul>
-                <li><strong>Date:</strong> {appointment.appointment_date}</li>
-                <li><strong>Time:</strong> {appointment.appointment_time}</li>
-            </ul>
-            <p>If you need to reschedule, please contact us to book a new appointment.</p>
-            <p>Best regards,<br>{self.app_name} Team</p>
-        </body>
-        </html>
-        """
+        return _CANCELLATION_TEMPLATE.substitute(
+            appointment_date=appointment.appointment_date,
+            appointment_time=appointment.appointment_time,
+            app_name=self.app_name
+        )
 
     def _create_medication_reminder_message(self, medications: List[str], appointment: AppointmentResponse) -> str:
         """Create HTML medication reminder message."""
-        medication_list = "\n".join([f"<li>{med}</li>" for med in medications])
+        # Medication names come from user input; escape them before building HTML
+        medication_list = "".join(f"<li>{escape(med)}</li>" for med in medications)
         
-        return f"""
-        <html>
-        <body>
-            <h2>Medication Reminder</h2>
-            <p>Dear Patient,</p>
-            <p>Please remember to take your prescribed medications:</p>
-            <ul>
-                {medication_list}
-            </ul>
-            <p>Your next appointment is scheduled for {appointment.appointment_date} at {appointment.appointment_time}.</p>
-            <p>If you have any questions about your medications, please contact your doctor.</p>
-            <p>Best regards,<br>{self.app_name} Team</p>
-        </body>
-        </html>
-        """
+        return _MEDICATION_REMINDER_TEMPLATE.substitute(
+            medication_list=medication_list,
+            appointment_date=appointment.appointment_date,
+            appointment_time=appointment.appointment_time,
+            app_name=self.app_name
+        )
+
+    def _record_reminder(self, key: str, reminder: AppointmentReminder):
+        """Store a sent reminder, evicting the oldest once max_reminders is exceeded."""
+        previous = self.sent_reminders.pop(key, None)
+        if previous is not None:
+            self._unindex_reminder(previous)
+        self.sent_reminders[key] = reminder
+        self._by_appointment[reminder.appointment_id].append(reminder)
+        
+        while len(self.sent_reminders) > self.max_reminders:
+            _, evicted = self.sent_reminders.popitem(last=False)
+            self._unindex_reminder(evicted)
+
+    def _unindex_reminder(self, reminder: AppointmentReminder):
+        reminders = self._by_appointment.get(reminder.appointment_id)
+        if reminders is None:
+            return
+        reminders.remove(reminder)
+        if not reminders:
+            del self._by_appointment[reminder.appointment_id]
 
     async def get_sent_reminders(self, appointment_id: str) -> List[AppointmentReminder]:
         """Get all sent reminders for an appointment."""
-        reminders = []
-        for key, reminder in self.sent_reminders.items():
-            if reminder.appointment_id == appointment_id:
-                reminders.append(reminder)
-        return reminders
+        return list(self._by_appointment.get(appointment_id, ()))
 
     async def send_bulk_reminders(self, appointments: List[AppointmentResponse], reminder_type: str):
         """
         Send bulk reminders for multiple appointments.
         """
         try:
-            success_count = 0
-            for appointment in appointments:
-                if reminder_type == "confirmation":
-                    success = await self.send_appointment_confirmation(appointment)
-                elif reminder_type == "24h":
-                    success = await self.send_appointment_reminder_24h(appointment)
-                elif reminder_type == "1h":
-                    success = await self.send_appointment_reminder_1h(appointment)
-                else:
-                    continue
+            senders = {
+                "confirmation": self.send_appointment_confirmation,
+                "24h": self.send_appointment_reminder_24h,
+                "1h": self.send_appointment_reminder_1h
+            }
+            send = senders.get(reminder_type)
+            if send is None:
+                return 0
+            
+            # Sent concurrently; the SMTP pool bounds how many are in flight
+            tasks = [asyncio.create_task(send(appointment)) for appointment in appointments]
+            
+            # On large batches give up once a third of the sends have failed, so an SMTP
+            # outage or rate limit doesn't burn through the whole batch
+            abort_on_failures = len(tasks) >= 30
+            failure_count = 0
+            for finished in asyncio.as_completed(tasks):
+                try:
+                    success = await finished
+                except Exception:
+                    success = False
                 
                 if success:
+                    continue
+                
+                failure_count += 1
+                if abort_on_failures and failure_count * 3 >= len(tasks):
+                    logger.warning(f"Aborting bulk reminders after {failure_count}/{len(tasks)} failures")
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    break
+            
+            # Tally from the tasks themselves: sends that finished during the abort still
+            # count, and cancelled ones are reported as skipped rather than dropped
+            success_count = failed_count = skipped_count = 0
+            for task in tasks:
+                if task.cancelled():
+                    skipped_count += 1
+                elif task.exception() is None and task.result():
                     success_count += 1
+                else:
+                    failed_count += 1
             
-            logger.info(f"Bulk reminders sent: {success_count}/{len(appointments)}")
+            logger.info(
+                f"Bulk reminders sent: {success_count}/{len(appointments)}, "
+                f"failed: {failed_count}, skipped: {skipped_count}"
+            )
             return success_count
             
         except Exception as e:
             logger.error(f"Error sending bulk reminders: {str(e)}")
             return 0
 
+# Shared instance, created on first use so processes that never notify open nothing
+_notification_service: Optional[NotificationService] = None
+
+def get_notification_service() -> NotificationService:
+    """Process-wide NotificationService, so every caller shares one SMTP pool."""
+    global _notification_service
+    if _notification_service is None:
+        _notification_service = NotificationService()
+    return _notification_service
 
+async def close_notification_service():
+    """Close the shared NotificationService, if one was created; run at application shutdown."""
+    global _notification_service
+    if _notification_service is not None:
+        await _notification_service.aclose()
+        _notification_service = None
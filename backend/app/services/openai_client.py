@@ -0,0 +1,23 @@
+import os
+from functools import cache
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI
+
+load_dotenv()
+
+
+@cache
+def get_openai_client() -> AsyncOpenAI:
+    """
+    Process-wide async OpenAI client, shared by chat completions and health
+    classification so both draw on one pool of kept-alive API connections.
+    """
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=64, max_connections=256),
+            timeout=httpx.Timeout(60.0, connect=10.0)
+        )
+    )
@@ -1,8 +1,6 @@
 import logging
 from typing import Dict
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class ScanAnalysisService:
@@ -1,9 +1,16 @@
 import os
+import asyncio
+import base64
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
+import cv2
 import numpy as np
+from cachetools import TTLCache
 from dotenv import load_dotenv
+from ..utils.hashing import content_key
 
 logger = logging.getLogger(__name__)
 
@@ -11,14 +18,103 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+def _resize_gray_uint8(image, size: int = 128) -> np.ndarray:
+    """
+    Convert an array ([0,1] float or uint8, gray or RGB) or PIL image to a
+    (size, size) uint8 grayscale array using OpenCV's SIMD resize.
+    """
+    if isinstance(image, np.ndarray):
+        gray = image if image.dtype == np.uint8 else (image * 255).astype(np.uint8)
+        if gray.ndim == 3:
+            gray = cv2.cvtColor(gray, cv2.COLOR_RGB2GRAY) if gray.shape[2] == 3 else gray[:, :, 0]
+    else:
+        gray = np.asarray(image.convert("L"))
+    if gray.shape == (size, size):
+        return gray
+    # Area averaging when shrinking, bilinear when enlarging
+    shrinking = gray.shape[0] > size or gray.shape[1] > size
+    interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+    return cv2.resize(gray, (size, size), interpolation=interpolation)
+
+def _stack_modalities(flair_image, t1ce_image) -> np.ndarray:
+    """Resize both modalities to 128x128 uint8 and stack them as (128, 128, 2) channels."""
+    return np.stack([_resize_gray_uint8(flair_image), _resize_gray_uint8(t1ce_image)], axis=-1)
+
+def _decode_gray(image_data: str) -> np.ndarray:
+    """Decode a base64-encoded image into a uint8 grayscale array."""
+    from PIL import Image
+    import io
+
+    image = Image.open(io.BytesIO(base64.b64decode(image_data)))
+    if image.mode != 'L':
+        image = image.convert('L')
+    return np.asarray(image)
+
+def _encode_png_base64(image: np.ndarray) -> str:
+    """
+    PNG-encode a uint8 gray or RGB array with OpenCV at low compression and
+    return it base64-encoded; masks are small, so fast encoding beats size.
+    """
+    if image.ndim == 3:
+        # OpenCV writes channels in BGR order
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    ok, buffer = cv2.imencode('.png', image, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    if not ok:
+        raise ValueError("Failed to encode segmentation image as PNG")
+    return base64.b64encode(buffer).decode('utf-8')
+# Quantized TFLite export modes, in the order the loader prefers them
+_TFLITE_MODES = ("int8", "fp16")
+
+def _tflite_filename(mode: str) -> str:
+    """Default file name of the quantized brain segmentation export for a mode."""
+    return f"brain_tumor_model_{mode}.tflite"
+
+# Brain segmentation classes, as class_statistics keys, in model output order
+_CLASS_KEYS = ('background', 'necrotic_core', 'edema', 'enhancing_tumor')
+# RGB overlay colour per class
+_CLASS_COLORS = np.array([
+    [0, 0, 0],        # Background - Black
+    [255, 0, 0],      # Necrotic Core - Red
+    [0, 255, 0],      # Edema - Green
+    [0, 0, 255]       # Enhancing Tumor - Blue
+], dtype=np.uint8)
+_CLASS_COLORS.flags.writeable = False
+# Volumes assume 1 mm³ per pixel for simplicity, reported in cm³
+_PIXEL_TO_VOLUME_CM3 = 1e-3
+
+# Micro-batching of concurrent dual-modality requests: wait up to this long for more
+_BATCH_WINDOW_SECONDS = 0.01
+_BATCH_MAX_SIZE = 8
+
 class SegmentationService:
     """
     Loads a Keras .h5 segmentation model lazily and runs inference.
     The model path is taken from SEGMENTATION_MODEL_PATH or a default location.
+    If an ONNX export exists (SEGMENTATION_ONNX_PATH or the default location)
+    and onnxruntime is installed, it is served through ONNX Runtime instead;
+    otherwise a quantized TFLite export (SEGMENTATION_TFLITE_PATH or the default
+    location) is preferred over the FP32 Keras model.
     """
 
     def __init__(self, model_path: Optional[str] = None):
         self._model = None
+        # Model variant taking uint8 pixels and normalizing inside the graph
+        self._uint8_model = None
+        # XLA-compiled concrete functions for the two models, None when unavailable
+        self._predict_fn = None
+        self._uint8_predict_fn = None
+        self._session = None
+        self._interpreter = None
+        # Per-thread preprocessing buffers reused across requests
+        self._buffers = threading.local()
+        # A single worker serializes batched inference and keeps it off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="brain-seg")
+        # Base64/image decoding is independent per request and runs in parallel
+        self._decode_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="brain-seg-decode")
+        # Pending (sample, future) items for _batch_worker, created on first use
+        # inside the running event loop
+        self._batch_queue: Optional[asyncio.Queue] = None
+        self._batch_worker_task = None
         # Resolve default path relative to this file, not CWD
         default_path = os.path.abspath(
             os.path.join(
@@ -31,10 +127,36 @@ class SegmentationService:
         )
         env_path = os.getenv("SEGMENTATION_MODEL_PATH")
         self._model_path = os.path.abspath(model_path or env_path or default_path)
+        default_onnx_path = os.path.join(os.path.dirname(default_path), "brain_tumor_model.onnx")
+        self._onnx_path = os.path.abspath(os.getenv("SEGMENTATION_ONNX_PATH") or default_onnx_path)
+        # Quantized exports are named by mode (see _tflite_filename); an explicit path wins
+        self._weights_dir = os.path.dirname(default_path)
+        env_tflite_path = os.getenv("SEGMENTATION_TFLITE_PATH")
+        self._tflite_candidates = [os.path.abspath(env_tflite_path)] if env_tflite_path else [
+            os.path.abspath(os.path.join(self._weights_dir, _tflite_filename(mode))) for mode in _TFLITE_MODES
+        ]
+        self._tflite_path = next((p for p in self._tflite_candidates if os.path.exists(p)), self._tflite_candidates[0])
         logger.info(f"Segmentation model path set to: {self._model_path}")
+        # Successful segmentation results keyed by a hash of the uploaded images
+        self._result_cache: TTLCache = TTLCache(maxsize=256, ttl=86400)
 
     def _ensure_model_loaded(self):
-        if self._model is None:
+        if self._model is None and self._session is None and self._interpreter is None:
+            if os.path.exists(self._onnx_path):
+                try:
+                    self._load_onnx_model()
+                    return
+                except Exception as e:
+                    logger.warning(f"ONNX model loading failed, trying other formats: {e}")
+                    self._session = None
+            self._tflite_path = next((p for p in self._tflite_candidates if os.path.exists(p)), self._tflite_path)
+            if os.path.exists(self._tflite_path):
+                try:
+                    self._load_tflite_model()
+                    return
+                except Exception as e:
+                    logger.warning(f"Quantized model loading failed, using Keras model: {e}")
+                    self._interpreter = None
             try:
                 # Import tensorflow/keras only when needed
                 from tensorflow import keras
@@ -47,10 +169,176 @@ class SegmentationService:
                 # Avoid needing training-time custom losses/metrics
                 self._model = keras.models.load_model(self._model_path, compile=False)
                 logger.info("Segmentation model loaded successfully")
+                self._build_uint8_model()
+                self._build_predict_fns()
             except Exception as exc:
                 logger.error(f"Failed to load segmentation model: {exc}")
                 raise
 
+    def _load_onnx_model(self):
+        """Load the ONNX export of the segmentation model into an ONNX Runtime session."""
+        import onnxruntime as ort
+
+        logger.info(f"Loading ONNX segmentation model from {self._onnx_path} ...")
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        available = ort.get_available_providers()
+        providers = [p for p in ("CUDAExecutionProvider", "OpenVINOExecutionProvider") if p in available]
+        self._session = ort.InferenceSession(
+            self._onnx_path,
+            sess_options=so,
+            providers=providers + ["CPUExecutionProvider"]
+        )
+        self._session_input = self._session.get_inputs()[0].name
+        logger.info(f"ONNX segmentation model loaded with providers {self._session.get_providers()}")
+
+    def _load_tflite_model(self):
+        """Load the quantized TFLite export of the segmentation model."""
+        import tensorflow as tf
+
+        logger.info(f"Loading quantized segmentation model from {self._tflite_path} ...")
+        interpreter = tf.lite.Interpreter(model_path=self._tflite_path)
+        interpreter.allocate_tensors()
+        self._interpreter = interpreter
+        self._tflite_input = interpreter.get_input_details()[0]
+        self._tflite_output = interpreter.get_output_details()[0]
+        # Report the mode the file actually holds, not the one its name suggests
+        mode = "int8" if self._tflite_input["dtype"] == np.int8 else "fp16"
+        logger.info(f"Quantized segmentation model loaded successfully ({mode})")
+
+    def _run_tflite(self, batch: np.ndarray) -> np.ndarray:
+        """Run the TFLite interpreter one sample at a time, (de)quantizing int8 tensors."""
+        input_details = self._tflite_input
+        output_details = self._tflite_output
+        in_scale, in_zero_point = input_details["quantization"]
+        out_scale, out_zero_point = output_details["quantization"]
+
+        outputs = []
+        for sample in batch:
+            sample = sample[np.newaxis, ...]
+            if input_details["dtype"] != np.float32 and in_scale:
+                sample = np.round(sample / in_scale + in_zero_point)
+            self._interpreter.set_tensor(input_details["index"], sample.astype(input_details["dtype"]))
+            self._interpreter.invoke()
+            output = self._interpreter.get_tensor(output_details["index"])
+            if output_details["dtype"] != np.float32 and out_scale:
+                output = (output.astype(np.float32) - out_zero_point) * out_scale
+            outputs.append(output)
+        return np.concatenate(outputs, axis=0)
+
+    def export_quantized_model(self, output_path: Optional[str] = None, representative_images: Optional[np.ndarray] = None) -> str:
+        """
+        Convert the Keras model to a quantized TFLite file.
+
+        Without representative_images this produces an FP16 model. With a stack
+        of preprocessed (128, 128, 2) FLAIR/T1CE inputs in [0,1] it produces a
+        full-integer int8 model calibrated on those samples.
+        """
+        import tensorflow as tf
+
+        self._ensure_model_loaded()
+        if self._model is None:
+            raise ValueError("Quantized export requires the Keras model; another model format is already active")
+
+        converter = tf.lite.TFLiteConverter.from_keras_model(self._model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+        if representative_images is not None:
+            def representative_dataset():
+                for image in representative_images:
+                    yield [np.asarray(image, dtype=np.float32)[np.newaxis, ...]]
+
+            converter.representative_dataset = representative_dataset
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+        else:
+            converter.target_spec.supported_types = [tf.float16]
+
+        tflite_model = converter.convert()
+        mode = "int8" if representative_images is not None else "fp16"
+        output_path = os.path.abspath(output_path or os.path.join(self._weights_dir, _tflite_filename(mode)))
+        with open(output_path, "wb") as f:
+            f.write(tflite_model)
+        logger.info(f"Quantized segmentation model written to {output_path}")
+        return output_path
+
+    def export_onnx_model(self, output_path: Optional[str] = None) -> str:
+        """Convert the Keras model to ONNX (run once at deploy time); requires tf2onnx."""
+        import tensorflow as tf
+        import tf2onnx
+
+        self._ensure_model_loaded()
+        if self._model is None:
+            raise ValueError("ONNX export requires the Keras model; another model format is already active")
+
+        output_path = os.path.abspath(output_path or self._onnx_path)
+        input_spec = (tf.TensorSpec((None,) + tuple(self._model.input_shape[1:]), tf.float32, name="input"),)
+        tf2onnx.convert.from_keras(self._model, input_signature=input_spec, opset=17, output_path=output_path)
+        logger.info(f"ONNX segmentation model written to {output_path}")
+        return output_path
+
+    def _build_uint8_model(self):
+        """
+        Wrap the model with a uint8 input that is cast and scaled to [0,1] inside
+        the graph, so 1-byte pixels are copied to the device and the divide runs there.
+        """
+        try:
+            import tensorflow as tf
+            from tensorflow import keras
+
+            inputs = keras.Input(shape=tuple(self._model.input_shape[1:]), dtype=tf.uint8)
+            scaled = keras.layers.Lambda(lambda x: tf.cast(x, tf.float32) / 255.0)(inputs)
+            self._uint8_model = keras.Model(inputs, self._model(scaled))
+        except Exception as e:
+            logger.warning(f"uint8 model input unavailable, normalizing on CPU: {e}")
+            self._uint8_model = None
+
+    def _compile_model(self, model, dtype):
+        """Trace model into an XLA-compiled concrete function, or None if tracing fails."""
+        try:
+            import tensorflow as tf
+
+            input_spec = tf.TensorSpec((None,) + tuple(model.input_shape[1:]), dtype)
+            return tf.function(
+                lambda x: model(x, training=False),
+                jit_compile=True,
+                input_signature=[input_spec]
+            ).get_concrete_function()
+        except Exception as e:
+            logger.warning(f"XLA compilation unavailable, using model.predict: {e}")
+            return None
+
+    def _build_predict_fns(self):
+        """
+        Compile both models once so single-sample inference skips the per-call
+        Keras predict machinery and never retraces.
+        """
+        import tensorflow as tf
+
+        self._predict_fn = self._compile_model(self._model, tf.float32)
+        if self._uint8_model is not None:
+            self._uint8_predict_fn = self._compile_model(self._uint8_model, tf.uint8)
+        logger.info("Segmentation model compiled with XLA")
+
+    def _run_model(self, batch: np.ndarray, uint8: bool = False) -> np.ndarray:
+        """Run inference through ONNX Runtime, TFLite or the compiled function, falling back to model.predict."""
+        if self._session is not None:
+            return self._session.run(None, {self._session_input: batch.astype(np.float32, copy=False)})[0]
+        if self._interpreter is not None:
+            return self._run_tflite(batch.astype(np.float32, copy=False))
+        predict_fn = self._uint8_predict_fn if uint8 else self._predict_fn
+        if predict_fn is not None:
+            try:
+                return predict_fn(batch).numpy()
+            except Exception as e:
+                logger.warning(f"XLA inference failed, falling back to model.predict: {e}")
+                if uint8:
+                    self._uint8_predict_fn = None
+                else:
+                    self._predict_fn = None
+        return (self._uint8_model if uint8 else self._model).predict(batch)
+
     def predict_mask(self, image_array: np.ndarray) -> np.ndarray:
         """
         Runs model inference and returns a binary/soft mask.
@@ -67,74 +355,125 @@ class SegmentationService:
         if image_array.ndim == 3:
             image_array = np.expand_dims(image_array, axis=0)
 
-        preds = self._model.predict(image_array)
+        preds = self._run_model(image_array.astype(np.float32, copy=False))
         return preds
 
+    def _input_buffer(self, dtype) -> np.ndarray:
+        """This thread's (1, 128, 128, 2) model input buffer of the given dtype."""
+        name = np.dtype(dtype).name
+        buffer = getattr(self._buffers, name, None)
+        if buffer is None:
+            buffer = np.empty((1, 128, 128, 2), dtype=dtype)
+            setattr(self._buffers, name, buffer)
+        return buffer
+
     def predict_from_modalities(self, flair_image: np.ndarray, t1ce_image: np.ndarray) -> np.ndarray:
         """
         Accepts two 2D arrays (grayscale) for FLAIR and T1CE, resizes and stacks
         into a (1, 128, 128, 2) tensor normalized to [0,1], and returns softmax
         logits of shape (1, 128, 128, 4).
         """
-        from PIL import Image
-
         if flair_image is None or t1ce_image is None:
             raise ValueError("Both flair_image and t1ce_image are required")
 
+        # Write both resized channels straight into the reused (1,128,128,2) buffer
+        stacked = self._input_buffer(np.uint8)
+        stacked[0, :, :, 0] = _resize_gray_uint8(flair_image)
+        stacked[0, :, :, 1] = _resize_gray_uint8(t1ce_image)
+
+        preds = self._predict_stacked(stacked)
+        return preds
+
+    def _predict_stacked(self, stacked: np.ndarray) -> np.ndarray:
+        """Run the model on an (N, 128, 128, 2) uint8 batch of FLAIR/T1CE inputs."""
         self._ensure_model_loaded()
 
-        # Ensure PIL Images for resizing then back to numpy
-        if isinstance(flair_image, np.ndarray):
-            flair_pil = Image.fromarray(
-                (flair_image * 255).astype(np.uint8) if flair_image.dtype != np.uint8 else flair_image
-            ).convert("L")
-        else:
-            flair_pil = flair_image.convert("L")
+        if self._uint8_model is not None:
+            # Hand over uint8 pixels; the wrapped model normalizes them itself
+            return self._run_model(stacked, uint8=True)
 
-        if isinstance(t1ce_image, np.ndarray):
-            t1ce_pil = Image.fromarray(
-                (t1ce_image * 255).astype(np.uint8) if t1ce_image.dtype != np.uint8 else t1ce_image
-            ).convert("L")
+        if len(stacked) == 1:
+            batched = self._input_buffer(np.float32)
         else:
-            t1ce_pil = t1ce_image.convert("L")
+            batched = np.empty(stacked.shape, dtype=np.float32)
+        np.multiply(stacked, 1.0 / 255.0, out=batched)
+        return self._run_model(batched)
 
-        flair_resized = flair_pil.resize((128, 128))
-        t1ce_resized = t1ce_pil.resize((128, 128))
+    async def predict_from_modalities_async(self, flair_image: np.ndarray, t1ce_image: np.ndarray) -> np.ndarray:
+        """
+        predict_from_modalities for concurrent callers: requests arriving within
+        _BATCH_WINDOW_SECONDS are stacked into one (N, 128, 128, 2) inference run
+        on the inference worker. Returns this request's (1, 128, 128, 4) slice.
+        """
+        if flair_image is None or t1ce_image is None:
+            raise ValueError("Both flair_image and t1ce_image are required")
 
-        flair_np = np.array(flair_resized, dtype=np.float32) / 255.0
-        t1ce_np = np.array(t1ce_resized, dtype=np.float32) / 255.0
+        # Resize on the decode pool too, keeping all pixel work off the event loop
+        sample = await asyncio.get_running_loop().run_in_executor(
+            self._decode_executor, _stack_modalities, flair_image, t1ce_image
+        )
+        if self._batch_queue is None:
+            self._batch_queue = asyncio.Queue()
+            self._batch_worker_task = asyncio.create_task(self._batch_worker())
+        future = asyncio.get_running_loop().create_future()
+        await self._batch_queue.put((sample, future))
+        return await future
 
-        stacked = np.stack([flair_np, t1ce_np], axis=-1)  # (128,128,2)
-        batched = np.expand_dims(stacked, axis=0)  # (1,128,128,2)
+    async def _batch_worker(self):
+        """Collect queued samples into batches and run each through the model."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._batch_queue.get()]
+            deadline = loop.time() + _BATCH_WINDOW_SECONDS
+            while len(batch) < _BATCH_MAX_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._batch_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
 
-        preds = self._model.predict(batched)
-        return preds
+            stacked = np.stack([sample for sample, _ in batch])
+            try:
+                preds = await loop.run_in_executor(self._executor, self._predict_stacked, stacked)
+            except Exception as e:
+                logger.error(f"Batched segmentation inference failed: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            logger.debug("Segmented a batch of %d dual-modality scans", len(batch))
+            for i, (_, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result(preds[i:i + 1])
 
     async def segment_image(self, image_data: str) -> dict:
         """
         High-level method for single image segmentation.
         This method handles the complete workflow from base64 image to segmentation result.
         """
+        key = content_key("single", image_data)
+        cached = self._result_cache.get(key)
+        if cached is not None:
+            logger.info("Image segmentation served from cache")
+            return dict(cached)
+
         try:
-            import base64
-            from PIL import Image
-            import io
-            
-            # Decode base64 image
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
+            loop = asyncio.get_running_loop()
             
-            # Convert to numpy array
-            if image.mode != 'L':
-                image = image.convert('L')
-            image_array = np.array(image, dtype=np.float32)
+            # Decode base64 image off the event loop
+            image_array = await loop.run_in_executor(self._decode_executor, _decode_gray, image_data)
             
-            # Normalize if needed
-            if image_array.max() > 1.0:
-                image_array = image_array / 255.0
+            # Normalize to [0, 1]: uint8 pixels are cast and scaled in one pass,
+            # float input is expected to be in [0, 1] already
+            if image_array.dtype == np.uint8:
+                image_array = np.multiply(image_array, np.float32(1.0 / 255.0), dtype=np.float32)
+            elif image_array.dtype != np.float32:
+                image_array = image_array.astype(np.float32, copy=False)
             
-            # Get segmentation prediction
-            prediction = self.predict_mask(image_array)
+            # Get segmentation prediction on the inference worker
+            prediction = await loop.run_in_executor(self._executor, self.predict_mask, image_array)
             
             # Process prediction to get binary mask
             if prediction.ndim == 4:  # (batch, height, width, channels)
@@ -151,12 +490,9 @@ class SegmentationService:
             segmentation_percentage = (segmented_pixels / total_pixels) * 100
             
             # Convert mask back to base64 for response
-            mask_image = Image.fromarray((binary_mask * 255).astype(np.uint8))
-            buffer = io.BytesIO()
-            mask_image.save(buffer, format='PNG')
-            mask_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            mask_base64 = _encode_png_base64((binary_mask * 255).astype(np.uint8))
             
-            return {
+            result = {
                 "success": True,
                 "segmentation_mask": mask_base64,
                 "statistics": {
@@ -166,6 +502,8 @@ class SegmentationService:
                 },
                 "message": "Image segmentation completed successfully"
             }
+            self._result_cache[key] = result
+            return dict(result)
             
         except Exception as e:
             logger.error(f"Error in image segmentation: {str(e)}")
@@ -180,31 +518,24 @@ class SegmentationService:
         High-level method for dual modality brain segmentation.
         This method handles the complete workflow from base64 images to segmentation result.
         """
+        key = content_key("dual", flair_image, t1ce_image)
+        cached = self._result_cache.get(key)
+        if cached is not None:
+            logger.info("Dual modality segmentation served from cache")
+            return dict(cached)
+
         try:
-            import base64
-            from PIL import Image
-            import io
+            loop = asyncio.get_running_loop()
             
-            # Decode FLAIR image
-            flair_bytes = base64.b64decode(flair_image)
-            flair_pil = Image.open(io.BytesIO(flair_bytes))
-            if flair_pil.mode != 'L':
-                flair_pil = flair_pil.convert('L')
-            flair_array = np.array(flair_pil, dtype=np.float32)
-            if flair_array.max() > 1.0:
-                flair_array = flair_array / 255.0
-            
-            # Decode T1CE image
-            t1ce_bytes = base64.b64decode(t1ce_image)
-            t1ce_pil = Image.open(io.BytesIO(t1ce_bytes))
-            if t1ce_pil.mode != 'L':
-                t1ce_pil = t1ce_pil.convert('L')
-            t1ce_array = np.array(t1ce_pil, dtype=np.float32)
-            if t1ce_array.max() > 1.0:
-                t1ce_array = t1ce_array / 255.0
+            # Decode the FLAIR and T1CE images in parallel, off the event loop;
+            # 8-bit pixels are kept, predict_from_modalities_async resizes and normalizes them
+            flair_array, t1ce_array = await asyncio.gather(
+                loop.run_in_executor(self._decode_executor, _decode_gray, flair_image),
+                loop.run_in_executor(self._decode_executor, _decode_gray, t1ce_image)
+            )
             
             # Get segmentation prediction
-            prediction = self.predict_from_modalities(flair_array, t1ce_array)
+            prediction = await self.predict_from_modalities_async(flair_array, t1ce_array)
             
             # Process prediction (assuming 4-class segmentation: background, necrotic core, edema, enhancing tumor)
             if prediction.ndim == 4:  # (batch, height, width, classes)
@@ -213,34 +544,26 @@ class SegmentationService:
                 pred = prediction
             
             # Get class predictions
-            class_predictions = np.argmax(pred, axis=-1)
+            # Only 4 classes, so keep the class map (and everything indexed by it) in uint8
+            class_predictions = np.argmax(pred, axis=-1).astype(np.uint8)
             
             # Calculate statistics for each class
             total_pixels = class_predictions.size
             class_stats = {}
-            class_names = ['Background', 'Necrotic Core', 'Edema', 'Enhancing Tumor']
             
-            for i, class_name in enumerate(class_names):
-                class_pixels = int(np.sum(class_predictions == i))  # Convert to Python int
+            # Pixel count per class in one pass over the class map
+            counts = np.bincount(class_predictions.ravel(), minlength=len(_CLASS_KEYS))
+            for i, class_key in enumerate(_CLASS_KEYS):
+                class_pixels = int(counts[i])  # Convert to Python int
                 percentage = float((class_pixels / total_pixels) * 100)  # Convert to Python float
-                class_stats[class_name.lower().replace(' ', '_')] = {
+                class_stats[class_key] = {
                     "pixels": class_pixels,
                     "percentage": percentage
                 }
             
             # Convert prediction to RGB visualization
-            colors = np.array([
-                [0, 0, 0],        # Background - Black
-                [255, 0, 0],      # Necrotic Core - Red
-                [0, 255, 0],      # Edema - Green
-                [0, 0, 255]       # Enhancing Tumor - Blue
-            ])
-            
-            rgb_prediction = colors[class_predictions]
-            pred_image = Image.fromarray(rgb_prediction.astype(np.uint8))
-            buffer = io.BytesIO()
-            pred_image.save(buffer, format='PNG')
-            pred_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            rgb_prediction = _CLASS_COLORS[class_predictions]
+            pred_base64 = _encode_png_base64(rgb_prediction)
             
             # Generate insights and recommendations
             insights = []
@@ -252,15 +575,14 @@ class SegmentationService:
             enhancing_pixels = class_stats.get('enhancing_tumor', {}).get('pixels', 0)
             
             # Calculate volumes (assuming 1mm³ per pixel for simplicity)
-            pixel_to_volume_ratio = 1.0  # mm³ per pixel
-            necrotic_volume = (necrotic_pixels * pixel_to_volume_ratio) / 1000.0  # cm³
-            edema_volume = (edema_pixels * pixel_to_volume_ratio) / 1000.0  # cm³
-            enhancing_volume = (enhancing_pixels * pixel_to_volume_ratio) / 1000.0  # cm³
+            necrotic_volume = necrotic_pixels * _PIXEL_TO_VOLUME_CM3
+            edema_volume = edema_pixels * _PIXEL_TO_VOLUME_CM3
+            enhancing_volume = enhancing_pixels * _PIXEL_TO_VOLUME_CM3
             total_tumor_volume = necrotic_volume + enhancing_volume
             
             # Generate insights based only on percentages and ratios (no duplicate volumes)
             if total_tumor_volume > 0.0 and total_pixels > 0:
-                total_brain_volume = (total_pixels * pixel_to_volume_ratio) / 1000.0
+                total_brain_volume = total_pixels * _PIXEL_TO_VOLUME_CM3
                 tumor_percentage = (total_tumor_volume / total_brain_volume) * 100
                 insights.append(f"Tumor occupies {tumor_percentage:.1f}% of total brain volume")
                 
@@ -282,7 +604,7 @@ class SegmentationService:
             recommendations.append("Monitor for neurological symptoms")
             recommendations.append("Review with radiologist for detailed analysis")
             
-            return {
+            result = {
                 "success": True,
                 "segmentation_result": pred_base64,
                 "class_statistics": class_stats,
@@ -291,6 +613,9 @@ class SegmentationService:
                 "recommendations": recommendations,
                 "message": "Dual modality brain segmentation completed successfully"
             }
+            self._result_cache[key] = result
+            # Callers add keys such as report_id, so hand out a copy
+            return dict(result)
             
         except Exception as e:
             logger.error(f"Error in dual modality segmentation: {str(e)}")
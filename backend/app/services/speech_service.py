@@ -1,37 +1,147 @@
-import whisper
+from faster_whisper import BatchedInferencePipeline, WhisperModel, decode_audio
+import ctranslate2
+import numpy as np
+import io
 import os
+import asyncio
+import math
+import re
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
 from pathlib import Path
+from typing import BinaryIO, Union
+from cachetools import TTLCache
+from ..utils.hashing import content_key
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Sample rate Whisper models are trained on
+WHISPER_SAMPLE_RATE = 16000
+# Model name or path to a CTranslate2-converted model directory; the distilled
+# English model decodes short utterances about twice as fast as small.en
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "distil-small.en")
+# Persistent directory for downloaded CTranslate2 models; None uses the Hugging Face cache
+WHISPER_MODEL_DIR = os.getenv("WHISPER_MODEL_DIR")
+# Intra-op threads per process, split across web workers so they don't oversubscribe the cores
+WHISPER_CPU_THREADS = int(os.getenv(
+    "WHISPER_CPU_THREADS",
+    str(max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", "1"))))
+))
+# Number of 30 s windows of a long recording decoded together in one model call
+WHISPER_BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", "8"))
+# Clips longer than one Whisper window are decoded in batches
+_BATCH_MIN_SAMPLES = 30 * WHISPER_SAMPLE_RATE
+# Options the batched pipeline accepts; it never conditions on previous text
+_BATCHED_OPTIONS = ("language", "temperature", "beam_size", "no_speech_threshold",
+                    "log_prob_threshold", "compression_ratio_threshold", "initial_prompt",
+                    "vad_filter", "vad_parameters")
+
+# Filler words and speech artifacts, removed in one pass with surrounding spaces and a trailing comma
+_FILLER_PATTERN = re.compile(r"\s*\b(?:um|uh|er|ah|hmm)\b,?\s*", re.IGNORECASE)
+# Common contractions and their expansions, replaced in one pass
+_CONTRACTIONS = {
+    "gonna": "going to",
+    "wanna": "want to",
+    "gotta": "got to",
+    "lemme": "let me",
+    "gimme": "give me",
+    "dunno": "don't know"
+}
+_CONTRACTION_PATTERN = re.compile(r"\b(?:" + "|".join(_CONTRACTIONS) + r")\b")
+
 class SpeechService:
     def __init__(self):
-        # Load the Whisper model (using small.en model for better English accuracy)
-        logger.info("Initializing Whisper model (English-optimized)...")
-        try:
-            self.model = whisper.load_model("small.en")
-            logger.info("Whisper model loaded successfully")
-        except Exception as e:
-            logger.error(f"Failed to load Whisper model: {e}")
-            # Fallback to base model if small.en fails
-            logger.info("Attempting to load base model as fallback...")
-            self.model = whisper.load_model("base")
-            logger.info("Base Whisper model loaded successfully")
+        # CTranslate2 backend with int8 weights; activations in FP16 on GPU
+        cuda = ctranslate2.get_cuda_device_count() > 0
+        self.device = "cuda" if cuda else "cpu"
+        self.compute_type = "int8_float16" if cuda else "int8"
+        # Loaded on first transcription by _ensure_model, not at import
+        self.model = None
+        self._batched_model = None
+        self._model_lock = threading.Lock()
+        # Single worker serializes access to the one Whisper model, off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+        # Transcripts of recent uploads keyed by audio content hash, so re-sent clips skip inference
+        self._transcript_cache = TTLCache(maxsize=512, ttl=86400)
         
         # Set optimized transcription options for medical conversations
         self.transcribe_options = {
             "language": "en",  # Force English language
             "temperature": 0.0,  # Use greedy decoding for consistency
+            "beam_size": 1,  # Greedy search; beam search multiplies decoder cost
+            "without_timestamps": True,  # Only the text is returned, so don't decode timestamp tokens
+            "vad_filter": True,  # Trim silence with Silero VAD so it isn't encoded or decoded
+            "vad_parameters": {"min_silence_duration_ms": 500},
             "no_speech_threshold": 0.2,  # More sensitive to speech detection
-            "logprob_threshold": -1.0,  # Allow lower confidence predictions
+            "log_prob_threshold": -1.0,  # Allow lower confidence predictions
             "compression_ratio_threshold": 2.4,
             "condition_on_previous_text": False,  # Don't rely on previous context to avoid errors
             "initial_prompt": "Medical symptoms, health questions, appointment scheduling: ",  # Medical context
         }
     
+    def _ensure_model(self):
+        """Load and warm up the Whisper model once, on first use."""
+        if self.model is not None:
+            return
+        with self._model_lock:
+            if self.model is not None:
+                return
+            # Load the Whisper model (English-only for accuracy on short medical utterances)
+            logger.info("Initializing Whisper model (English-optimized)...")
+            try:
+                model = self._load_model(WHISPER_MODEL)
+                logger.info("Whisper model loaded successfully")
+            except Exception as e:
+                logger.error(f"Failed to load Whisper model: {e}")
+                # Fallback to base model if the configured model fails
+                logger.info("Attempting to load base model as fallback...")
+                model = self._load_model("base")
+                logger.info("Base Whisper model loaded successfully")
+            self._warm_up(model)
+            self._batched_model = BatchedInferencePipeline(model=model)
+            self.model = model
+
+    def _load_model(self, name: str) -> WhisperModel:
+        """Load a CTranslate2 Whisper model, from the on-disk cache when it is already there."""
+        options = {
+            "device": self.device,
+            "compute_type": self.compute_type,
+            "download_root": WHISPER_MODEL_DIR,
+            "cpu_threads": WHISPER_CPU_THREADS,
+            # Calls are serialized on one executor thread, so one model replica is enough
+            "num_workers": 1,
+        }
+        try:
+            # Memory-map the already-converted model without contacting the hub
+            return WhisperModel(name, local_files_only=True, **options)
+        except Exception:
+            logger.info(f"Whisper model {name} not cached locally, downloading...")
+            return WhisperModel(name, **options)
+
+    def _warm_up(self, model: WhisperModel):
+        """Run one transcription of 1s of silence so kernel setup isn't paid by the first request."""
+        try:
+            segments, _ = model.transcribe(np.zeros(WHISPER_SAMPLE_RATE, dtype=np.float32), language="en", beam_size=1)
+            for _ in segments:
+                pass
+            logger.info("Whisper model warmed up")
+        except Exception as e:
+            logger.warning(f"Whisper warmup failed: {e}")
+
+    def _run_transcribe(self, audio, **options) -> dict:
+        """Transcribe and join the segments into a Whisper-style {"text": ...} result."""
+        self._ensure_model()
+        if isinstance(audio, np.ndarray) and audio.shape[0] > _BATCH_MIN_SAMPLES:
+            # Long recordings: speech chunks found by VAD go through the encoder/decoder as one batch
+            batched_options = {key: value for key, value in options.items() if key in _BATCHED_OPTIONS}
+            segments, _ = self._batched_model.transcribe(audio, batch_size=WHISPER_BATCH_SIZE, **batched_options)
+        else:
+            # Segments are generated lazily; decoding happens while they are consumed
+            segments, _ = self.model.transcribe(audio, **options)
+        return {"text": "".join(segment.text for segment in segments)}
+
     async def transcribe_audio(self, audio_file_path: str) -> str:
         """
         Transcribe audio file using optimized Whisper approach with API compatibility fix
@@ -55,126 +165,143 @@ class SpeechService:
             if file_size == 0:
                 raise ValueError("Audio file is empty")
             
-            # Preprocess audio for better transcription
-            processed_audio_path = await self._preprocess_audio(audio_path)
+            return await self._transcribe(audio_path)
             
-            # Use compatibility-safe transcription approach
-            logger.info("Starting Whisper transcription with compatibility mode...")
-            result = await self._safe_transcribe(processed_audio_path)
+        except Exception as e:
+            return self._transcription_error(e)
+
+    async def transcribe_bytes(self, content: bytes) -> str:
+        """
+        Transcribe an in-memory audio upload without writing it to a temporary file
+        """
+        try:
+            logger.info(f"Starting transcription of {len(content)} bytes of audio")
+            if not content:
+                raise ValueError("Audio file is empty")
+            key = content_key(content)
+            cached = self._transcript_cache.get(key)
+            if cached is not None:
+                logger.info("Transcription served from cache")
+                return cached
+            transcription = await self._transcribe(io.BytesIO(content))
+            self._transcript_cache[key] = transcription
+            return transcription
+        except Exception as e:
+            return self._transcription_error(e)
+
+    async def _transcribe(self, source: Union[Path, BinaryIO]) -> str:
+        """Decode, transcribe and clean up audio from a path or file object."""
+        # Preprocess audio for better transcription; decoding blocks, so run it in a thread
+        audio = await asyncio.to_thread(self._preprocess_audio, source)
+        
+        logger.info("Starting Whisper transcription...")
+        result = await self._safe_transcribe(audio)
+        
+        if result and "text" in result:
+            transcribed_text = result["text"].strip()
+            logger.info(f"Raw transcription result: '{transcribed_text}'")
             
-            # Clean up temporary processed file if different from original
-            if processed_audio_path != audio_path:
-                try:
-                    os.unlink(processed_audio_path)
-                except:
-                    pass
+            # Clean up the transcribed text
+            cleaned_text = self._clean_transcription(transcribed_text)
             
-            if result and "text" in result:
-                transcribed_text = result["text"].strip()
-                logger.info(f"Raw transcription result: '{transcribed_text}'")
-                
-                # Clean up the transcribed text
-                cleaned_text = self._clean_transcription(transcribed_text)
-                
-                if cleaned_text and len(cleaned_text) > 0:
-                    logger.info(f"Final cleaned transcription: '{cleaned_text}'")
-                    return cleaned_text
-                else:
-                    logger.warning("Transcription returned empty text after cleaning")
-                    return "I didn't catch that clearly. Could you please speak again?"
+            if cleaned_text and len(cleaned_text) > 0:
+                logger.info(f"Final cleaned transcription: '{cleaned_text}'")
+                return cleaned_text
             else:
-                logger.error("No text found in transcription result")
-                logger.error(f"Full result: {result}")
-                raise ValueError("No text in transcription result")
-            
-        except Exception as e:
-            logger.error(f"Transcription failed with error: {str(e)}")
-            logger.error(f"Error type: {type(e).__name__}")
-            import traceback
-            logger.error(f"Full traceback: {traceback.format_exc()}")
-            
-            # Return a helpful error message instead of random mock text
-            return "I'm having trouble hearing you clearly. Please try speaking again."
+                logger.warning("Transcription returned empty text after cleaning")
+                return "I didn't catch that clearly. Could you please speak again?"
+        else:
+            logger.error("No text found in transcription result")
+            logger.error(f"Full result: {result}")
+            raise ValueError("No text in transcription result")
+
+    def _transcription_error(self, e: Exception) -> str:
+        """Log a failed transcription and return the message shown to the user."""
+        logger.error(f"Transcription failed with error: {str(e)}")
+        logger.error(f"Error type: {type(e).__name__}")
+        import traceback
+        logger.error(f"Full traceback: {traceback.format_exc()}")
+        
+        # Return a helpful error message instead of random mock text
+        return "I'm having trouble hearing you clearly. Please try speaking again."
     
-    async def _safe_transcribe(self, audio_path: Path) -> dict:
+    async def _safe_transcribe(self, audio: Union[np.ndarray, Path, BinaryIO]) -> dict:
         """
-        Safe transcription method that handles API compatibility issues
+        Run a single transcription with the configured options.
+        Accepts decoded 16 kHz mono samples, or a path or file object for Whisper to decode itself.
         """
+        if isinstance(audio, Path):
+            audio = str(audio)
         try:
-            # Try the direct approach first (works with most versions)
-            logger.info("Attempting direct transcription...")
-            
-            # Use minimal options to avoid compatibility issues
-            basic_options = {
-                "language": "en",
-                "temperature": 0.0,
-            }
-            
-            result = self.model.transcribe(str(audio_path), **basic_options)
-            logger.info("Direct transcription successful")
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                self._executor, lambda: self._run_transcribe(audio, **self.transcribe_options)
+            )
+            logger.info("Transcription successful")
             return result
-            
-        except TypeError as e:
-            logger.warning(f"Direct transcription failed with TypeError: {e}")
-            logger.info("Trying compatibility mode...")
-            
-            # Fallback: use the most basic transcription call
-            try:
-                result = self.model.transcribe(str(audio_path))
-                logger.info("Basic transcription successful")
-                return result
-            except Exception as e2:
-                logger.error(f"Basic transcription also failed: {e2}")
-                raise e2
-                
         except Exception as e:
             logger.error(f"Transcription failed with: {e}")
             raise
 
-    async def _preprocess_audio(self, audio_path: Path) -> Path:
+    def _preprocess_audio(self, audio_path: Union[Path, BinaryIO]) -> Union[np.ndarray, Path, BinaryIO]:
         """
         Preprocess audio file for better transcription quality
-        Returns path to processed file (may be same as input if no processing needed)
+        Returns normalized 16 kHz mono float32 samples, or the original path or
+        file object if the audio can't be decoded here
         """
+        source = audio_path if hasattr(audio_path, "read") else str(audio_path)
         try:
-            # Try to use soundfile for audio preprocessing if available
             try:
-                import soundfile as sf
-                import numpy as np
-                
-                logger.info("Preprocessing audio with soundfile...")
-                
-                # Read audio data
-                data, sample_rate = sf.read(str(audio_path))
-                logger.info(f"Original audio: sample_rate={sample_rate}, shape={data.shape}")
-                
-                # Normalize audio to prevent clipping
-                if len(data) > 0:
-                    max_val = np.abs(data).max()
-                    if max_val > 0:
-                        data = data / max_val * 0.8  # Leave some headroom
-                
-                # Create temporary processed file
-                import tempfile
-                temp_fd, temp_path = tempfile.mkstemp(suffix='.wav', prefix='processed_')
-                os.close(temp_fd)  # Close the file descriptor
-                
-                # Write processed audio
-                sf.write(temp_path, data, sample_rate)
-                logger.info(f"Audio preprocessed and saved to: {temp_path}")
-                
-                return Path(temp_path)
-                
-            except ImportError:
-                logger.info("soundfile not available, using original audio file")
-                return audio_path
+                data = self._read_soundfile(source)
             except Exception as e:
-                logger.warning(f"Audio preprocessing failed: {e}, using original file")
-                return audio_path
+                # Compressed formats (webm, mp3, m4a) that libsndfile can't read are
+                # decoded and resampled in-process by PyAV, which faster-whisper bundles
+                logger.info(f"soundfile could not decode audio ({e}), decoding with PyAV...")
+                data = decode_audio(self._rewind(source), sampling_rate=WHISPER_SAMPLE_RATE)
+            
+            # Normalize audio to prevent clipping, in place on the float32 samples
+            if len(data) > 0:
+                # Peak magnitude without allocating an np.abs() copy
+                max_val = float(max(data.max(), -data.min()))
+                if max_val > 0:
+                    np.multiply(data, 0.8 / max_val, out=data)  # Leave some headroom
+            
+            # Hand the samples straight to Whisper instead of re-encoding a WAV for it to decode
+            logger.info(f"Audio preprocessed: {data.shape[0]} samples at {WHISPER_SAMPLE_RATE} Hz")
+            return data
                 
         except Exception as e:
-            logger.error(f"Error in audio preprocessing: {e}")
-            return audio_path
+            logger.warning(f"Audio preprocessing failed: {e}, using original file")
+            return self._rewind(audio_path)
+
+    def _read_soundfile(self, source: Union[str, BinaryIO]) -> np.ndarray:
+        """Read audio with soundfile as 16 kHz mono float32 samples."""
+        import soundfile as sf
+        
+        logger.info("Preprocessing audio with soundfile...")
+        
+        # Read audio data
+        data, sample_rate = sf.read(source, dtype='float32')
+        logger.info(f"Original audio: sample_rate={sample_rate}, shape={data.shape}")
+        
+        # Whisper expects mono audio at 16 kHz
+        if data.ndim == 2:
+            data = data.mean(axis=1, dtype=np.float32)
+        if sample_rate != WHISPER_SAMPLE_RATE:
+            from scipy.signal import resample_poly
+            factor = math.gcd(sample_rate, WHISPER_SAMPLE_RATE)
+            # Polyphase filtering keeps float32 input in float32, so no extra copy
+            data = resample_poly(
+                data, WHISPER_SAMPLE_RATE // factor, sample_rate // factor
+            ).astype(np.float32, copy=False)
+        return data
+
+    @staticmethod
+    def _rewind(source: Union[Path, BinaryIO]) -> Union[Path, BinaryIO]:
+        """Seek a partially read file object back to the start so Whisper can decode it."""
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return source
 
     def _clean_transcription(self, text: str) -> str:
         """Clean and normalize transcribed text"""
@@ -185,24 +312,10 @@ class SpeechService:
         text = text.strip()
         
         # Remove filler words and speech artifacts
-        filler_words = ["um", "uh", "er", "ah", "hmm"]
-        for filler in filler_words:
-            text = text.replace(f" {filler} ", " ")
-            text = text.replace(f"{filler} ", "")
-            text = text.replace(f" {filler}", "")
+        text = _FILLER_PATTERN.sub(" ", text)
         
         # Fix common contractions
-        contractions = {
-            "gonna": "going to",
-            "wanna": "want to", 
-            "gotta": "got to",
-            "lemme": "let me",
-            "gimme": "give me",
-            "dunno": "don't know"
-        }
-        
-        for contraction, expansion in contractions.items():
-            text = text.replace(contraction, expansion)
+        text = _CONTRACTION_PATTERN.sub(lambda m: _CONTRACTIONS[m.group()], text)
         
         # Clean up multiple spaces
         text = " ".join(text.split())
@@ -215,4 +328,9 @@ class SpeechService:
     
 
     
- 
\ No newline at end of file
+ 
+
+@cache
+def get_speech_service() -> SpeechService:
+    """Process-wide SpeechService; the Whisper model itself loads on first transcription."""
+    return SpeechService()
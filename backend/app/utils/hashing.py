@@ -0,0 +1,26 @@
+import hashlib
+from typing import Union
+
+try:
+    import xxhash
+except ImportError:  # Fall back to the stdlib hash when xxhash isn't installed
+    xxhash = None
+
+
+def _new_digest():
+    # Cache keys need no cryptographic strength; xxh3 is much faster on multi-MB uploads
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+def content_key(*parts: Union[str, bytes]) -> str:
+    """
+    Short digest identifying a request payload (e.g. base64 uploads), for result caches.
+    """
+    digest = _new_digest()
+    for part in parts:
+        digest.update(part.encode('utf-8') if isinstance(part, str) else part)
+        # Separator so ("ab", "c") and ("a", "bc") hash differently
+        digest.update(b'\0')
+    return digest.hexdigest()
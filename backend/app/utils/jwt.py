@@ -1,19 +1,56 @@
-from datetime import datetime, timedelta
-from jose import JWTError, jwt
+import hashlib
+import threading
+import time
+from datetime import timedelta
+from cachetools import TLRUCache
+import jwt
+from jwt import InvalidTokenError
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from app.config import SECRET_KEY
 
 ALGORITHM = "HS256"
+# Accepted algorithms, built once; pinning them rejects alg-confusion tokens
+ALGORITHMS = [ALGORITHM]
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+# Default token lifetime in seconds, for the integer exp claim
+_DEFAULT_TTL = ACCESS_TOKEN_EXPIRE_MINUTES * 60
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+# Seconds a verified token is reused before its signature is checked again
+_VERIFY_CACHE_TTL = 60
+
+
+def _verified_token_expiry(key, payload, now):
+    # Expire entries after the reuse window or at the token's own exp, whichever is first
+    return min(now + _VERIFY_CACHE_TTL, payload.get("exp", now))
+
+
+# Per-process cache of verified payloads, keyed by token digest and timed in epoch
+# seconds to match exp; sync dependencies run in the threadpool, so access is locked
+_verified_tokens = TLRUCache(maxsize=10000, ttu=_verified_token_expiry, timer=time.time)
+_verified_tokens_lock = threading.Lock()
+
+
+def _decode_token(token: str) -> dict:
+    """Decode and verify a token, reusing a recent verification of the same token."""
+    # blake2b rather than a non-cryptographic hash, so a forged token can't collide with a cached one
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    with _verified_tokens_lock:
+        payload = _verified_tokens.get(key)
+    if payload is not None:
+        return dict(payload)
+    payload = jwt.decode(token, SECRET_KEY, algorithms=ALGORITHMS)
+    with _verified_tokens_lock:
+        _verified_tokens[key] = payload
+    return dict(payload)
+
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    ttl = int(expires_delta.total_seconds()) if expires_delta else _DEFAULT_TTL
+    to_encode["exp"] = int(time.time()) + ttl
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
@@ -24,9 +61,9 @@ def verify_token(token: str):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode_token(token)
         return payload
-    except JWTError:
+    except InvalidTokenError:
         raise credentials_exception
 
 
@@ -37,9 +74,9 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     logger.info(f"JWT Authentication attempt - Token received: {token[:20]}..." if token else "No token received")
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode_token(token)
         logger.info(f"JWT Authentication successful - User: {payload.get('sub', 'Unknown')}")
         return payload
-    except JWTError as e:
+    except InvalidTokenError as e:
         logger.error(f"JWT Authentication failed - Error: {str(e)}")
         raise HTTPException(status_code=401, detail="Invalid token")